@@ -0,0 +1,68 @@
+"""
+Attack tables, computed once at import time. Every table is indexed by
+square number y * 8 + x and lists target square numbers, in bounds only,
+so callers never have to check bounds themselves.
+"""
+
+KNIGHT_OFFSETS = (
+  (-2, 1), (-1, 2), (1, 2), (2, 1),
+  (2, -1), (1, -2), (-1, -2), (-2, -1),
+)
+
+KING_OFFSETS = (
+  (-1, 0), (-1, 1), (0, 1), (1, 1),
+  (1, 0), (1, -1), (0, -1), (-1, -1),
+)
+
+# The 8 ray directions, clockwise from north. Orthogonal directions have
+# even indices and diagonal ones odd indices.
+DIRECTIONS = (
+  (-1, 0), # North
+  (-1, 1), # North-east
+  (0, 1), # East
+  (1, 1), # South-east
+  (1, 0), # South
+  (1, -1), # South-west
+  (0, -1), # West
+  (-1, -1), # North-west
+)
+ORTHOGONAL = (0, 2, 4, 6)
+DIAGONAL = (1, 3, 5, 7)
+
+# Direction a pawn of each color moves in
+PAWN_FORWARD = {
+  'w': -1,
+  'b': 1,
+}
+
+def _leaps(y: int, x: int, offsets):
+  return tuple(
+    (y + d_y) * 8 + x + d_x for d_y, d_x in offsets
+    if 0 <= y + d_y <= 7 and 0 <= x + d_x <= 7
+  )
+
+def _ray(y: int, x: int, d_y: int, d_x: int):
+  ray = []
+  y, x = y + d_y, x + d_x
+  while 0 <= y <= 7 and 0 <= x <= 7:
+    ray.append(y * 8 + x)
+    y, x = y + d_y, x + d_x
+
+  return tuple(ray)
+
+KNIGHT_ATTACKS = [_leaps(y, x, KNIGHT_OFFSETS) for y in range(8) for x in range(8)]
+
+KING_ATTACKS = [_leaps(y, x, KING_OFFSETS) for y in range(8) for x in range(8)]
+
+# Squares a pawn of the given color standing on the square attacks
+PAWN_ATTACKS = {
+  color: [_leaps(y, x, ((forward, -1), (forward, 1))) for y in range(8) for x in range(8)]
+  for color, forward in PAWN_FORWARD.items()
+}
+
+# RAYS[square][direction]: squares from the square out to the edge of the
+# board, nearest first.
+RAYS = [
+  tuple(_ray(y, x, d_y, d_x) for d_y, d_x in DIRECTIONS)
+  for y in range(8) for x in range(8)
+]
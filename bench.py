@@ -0,0 +1,153 @@
+from bitboard import BACKENDS
+from game import AI, RootSplitSearch, LazySMPSearch
+from move import Move
+from perft import PERFT_SUITE
+
+import argparse
+import json
+import queue
+import sys
+import time
+import zlib
+
+DEFAULT_DEPTH = 4
+
+# Search techniques that can be turned off, by the name of their AI switch
+SWITCHES = ('pvs', 'aspiration', 'null_move', 'lmr', 'futility', 'razoring', 'mate_distance')
+
+"""
+Searches every position of the perft suite with a fresh AI, through
+get_best_position_ID like a game does, up to depth or until an iteration
+ends with more than node_budget nodes searched in the position. Both
+limits only depend on the search itself, never on the clock, so the same
+code searches the same tree on any machine.
+
+The signature is a checksum of the node counts and best moves. It changes
+when, and only when, search behaviour changes.
+"""
+def run_bench(backend: str='array', depth: int=DEFAULT_DEPTH, node_budget: int=None,
+  disable=()):
+  results = []
+
+  for position in PERFT_SUITE:
+    board = BACKENDS[backend].from_fen(position['fen'])
+    ai = AI(board.turn)
+    for switch in disable:
+      setattr(ai, f"use_{switch}", False)
+    records = queue.SimpleQueue()
+
+    start = time.perf_counter()
+    ai.get_best_position_ID(board, board.turn, records, max_depth=depth, max_nodes=node_budget)
+    seconds = time.perf_counter() - start
+
+    while True:
+      record = records.get()
+      if record is None:
+        break
+      last = record
+
+    nodes = ai.nodes + ai.qnodes
+    results.append({
+      'name': position['name'],
+      'depth': last.depth,
+      'nodes': ai.nodes,
+      'qnodes': ai.qnodes,
+      'score': last.score,
+      'best_move': Move.decode(last.move).notation() if last.move is not None else None,
+      'seconds': round(seconds, 4),
+      'nps': round(nodes / seconds) if seconds else None,
+    })
+
+  signature = 0
+  for result in results:
+    line = f"{result['name']} {result['depth']} {result['nodes']} {result['qnodes']} {result['best_move']}"
+    signature = zlib.crc32(line.encode(), signature)
+
+  nodes = sum(result['nodes'] + result['qnodes'] for result in results)
+  seconds = sum(result['seconds'] for result in results)
+
+  return {
+    'backend': backend,
+    'disabled': list(disable),
+    'positions': results,
+    'nodes': nodes,
+    'seconds': round(seconds, 4),
+    'nps': round(nodes / seconds) if seconds else None,
+    'signature': f"{signature:08x}",
+  }
+
+PARALLEL_SEARCHES = {
+  'root_split': RootSplitSearch,
+  'lazy_smp': LazySMPSearch,
+}
+
+"""
+Time to depth of a parallel search (see PARALLEL_SEARCHES) with workers
+processes against the plain single process AI, over the perft suite
+positions. The processes are started before the clock is.
+"""
+def run_speedup(backend: str='array', depth: int=DEFAULT_DEPTH, workers: int=2,
+  parallel: str='root_split'):
+  searches = {1: AI('w'), workers: PARALLEL_SEARCHES[parallel](workers, backend=backend)}
+  results = []
+
+  for position in PERFT_SUITE:
+    result = {'name': position['name']}
+
+    for count, search in searches.items():
+      board = BACKENDS[backend].from_fen(position['fen'])
+      records = queue.SimpleQueue()
+
+      start = time.perf_counter()
+      search.get_best_position_ID(board, board.turn, records, max_depth=depth)
+      result[f"seconds_{count}"] = round(time.perf_counter() - start, 4)
+
+    result['speedup'] = round(result['seconds_1'] / result[f"seconds_{workers}"], 2)
+    results.append(result)
+
+  searches[workers].close()
+
+  seconds_1 = sum(result['seconds_1'] for result in results)
+  seconds_n = sum(result[f"seconds_{workers}"] for result in results)
+
+  return {
+    'backend': backend,
+    'depth': depth,
+    'workers': workers,
+    'parallel': parallel,
+    'positions': results,
+    'speedup': round(seconds_1 / seconds_n, 2),
+  }
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Reproducible search measurements.")
+  parser.add_argument('--backend', choices=sorted(BACKENDS), default='array')
+  parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+    help="deepest iteration to search")
+  parser.add_argument('--nodes', type=int,
+    help="stop deepening once a position has searched this many nodes")
+  parser.add_argument('--disable', choices=SWITCHES, action='append', default=[],
+    help="search without this technique, to measure what it saves")
+  parser.add_argument('--workers', type=int,
+    help="report the speedup of a parallel search with this many processes")
+  parser.add_argument('--parallel', choices=sorted(PARALLEL_SEARCHES), default='root_split',
+    help="parallel search to report on with --workers")
+  parser.add_argument('--json', action='store_true', help="print the full report as JSON")
+  args = parser.parse_args()
+
+  if args.workers:
+    report = run_speedup(args.backend, args.depth, args.workers, args.parallel)
+    print(json.dumps(report, indent=2))
+    sys.exit()
+
+  report = run_bench(args.backend, args.depth, args.nodes, args.disable)
+
+  if args.json:
+    print(json.dumps(report, indent=2))
+  else:
+    for result in report['positions']:
+      print(f"{result['name']:<16} depth {result['depth']}  nodes {result['nodes'] + result['qnodes']:>9}"
+        f"  best {result['best_move']}  score {result['score']}")
+    print(f"Nodes searched: {report['nodes']}")
+    print(f"Nodes/second: {report['nps']}")
+    print(f"Signature: {report['signature']}")
@@ -0,0 +1,200 @@
+from chessboard import Chessboard, OTHER_COLOR
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_FORWARD, RAYS, ORTHOGONAL, DIAGONAL, DIRECTIONS
+from pieces import *
+
+"""
+Precomputed masks for the bitboard backend. Bit y * 8 + x of a bitboard
+stands for square (y, x), like the square numbers everywhere else.
+"""
+def _mask(squares):
+  mask = 0
+  for sq in squares:
+    mask |= 1 << sq
+  return mask
+
+KNIGHT_MASKS = [_mask(targets) for targets in KNIGHT_ATTACKS]
+KING_MASKS = [_mask(targets) for targets in KING_ATTACKS]
+PAWN_MASKS = {
+  color: [_mask(targets) for targets in table]
+  for color, table in PAWN_ATTACKS.items()
+}
+RAY_MASKS = [[_mask(ray) for ray in rays] for rays in RAYS]
+
+# Rays whose square numbers go up from the origin find their nearest blocker
+# in the lowest set bit; the others in the highest.
+INCREASING = tuple(d_y * 8 + d_x > 0 for d_y, d_x in DIRECTIONS)
+
+def bishop_attacks(sq: int, occupied: int):
+  return slider_attacks(sq, occupied, DIAGONAL)
+
+def rook_attacks(sq: int, occupied: int):
+  return slider_attacks(sq, occupied, ORTHOGONAL)
+
+"""
+Classical ray attacks: take the whole ray, find the first blocker on it,
+and cut away the part of the ray that lies behind the blocker.
+"""
+def slider_attacks(sq: int, occupied: int, directions):
+  rays = RAY_MASKS[sq]
+  attacks = 0
+
+  for direction in directions:
+    ray = rays[direction]
+    blockers = ray & occupied
+
+    if blockers:
+      if INCREASING[direction]:
+        blocker = (blockers & -blockers).bit_length() - 1
+      else:
+        blocker = blockers.bit_length() - 1
+      ray ^= RAY_MASKS[blocker][direction]
+
+    attacks |= ray
+
+  return attacks
+
+def squares_of(bitboard: int):
+  while bitboard:
+    lowest = bitboard & -bitboard
+    yield lowest.bit_length() - 1
+    bitboard ^= lowest
+
+"""
+Chessboard whose move generation and attack detection run on bitboards:
+one Python int per piece code, plus the occupancy of each side. The piece
+code array of Chessboard is still kept, so that everything else (scoring,
+hashing, checks and pins, the Piece adapters) works unchanged.
+"""
+class BitboardChessboard(Chessboard):
+  def setup(self, codes, turn: str):
+    super().setup(codes, turn)
+    self.bitboards = {
+      sign * kind: 0
+      for kind in range(PAWN, KING + 1)
+      for sign in COLOR_SIGN.values()
+    }
+    self.occupancy = {'w': 0, 'b': 0}
+
+    for sq, code in enumerate(self.squares):
+      if code != EMPTY:
+        self.bitboards[code] |= 1 << sq
+        self.occupancy['w' if code > 0 else 'b'] |= 1 << sq
+
+  def make_move(self, move: Move):
+    undo = super().make_move(move)
+    self.move_bits(undo)
+    return undo
+
+  def unmake_move(self, undo):
+    super().unmake_move(undo)
+    self.move_bits(undo)
+
+  """
+  Moving a piece there and back flips the same bits, so make_move and
+  unmake_move share this.
+  """
+  def move_bits(self, undo):
+    from_c, to_c = undo.move.from_coord, undo.move.to_coord
+    from_to = (1 << (from_c.y * 8 + from_c.x)) | (1 << (to_c.y * 8 + to_c.x))
+    color = 'w' if undo.moved > 0 else 'b'
+
+    self.bitboards[undo.moved] ^= from_to
+    self.occupancy[color] ^= from_to
+
+    if undo.captured != EMPTY:
+      to_bit = 1 << (to_c.y * 8 + to_c.x)
+      self.bitboards[undo.captured] ^= to_bit
+      self.occupancy[OTHER_COLOR[color]] ^= to_bit
+
+  def snapshot(self):
+    new_chessboard = super().snapshot()
+    new_chessboard.bitboards = dict(self.bitboards)
+    new_chessboard.occupancy = dict(self.occupancy)
+    return new_chessboard
+
+  def targets_from(self, sq: int, code: int, occupied: int):
+    kind = abs(code)
+
+    if kind == KNIGHT:
+      return KNIGHT_MASKS[sq]
+    if kind == KING:
+      return KING_MASKS[sq]
+    if kind == BISHOP:
+      return bishop_attacks(sq, occupied)
+    if kind == ROOK:
+      return rook_attacks(sq, occupied)
+
+    return bishop_attacks(sq, occupied) | rook_attacks(sq, occupied)
+
+  def moves_from(self, sq: int, captures: bool=True, quiets: bool=True):
+    code = self.squares[sq]
+    color = 'w' if code > 0 else 'b'
+    own = self.occupancy[color]
+    enemy = self.occupancy[OTHER_COLOR[color]]
+    empty = ~(own | enemy)
+
+    if abs(code) == PAWN:
+      targets = 0
+
+      if quiets:
+        forward = 8 * PAWN_FORWARD[color]
+        target = sq + forward
+        if 0 <= target < 64 and empty >> target & 1:
+          targets |= 1 << target
+
+          # Pawn is in starting position
+          if sq >> 3 == (6 if color == 'w' else 1) and empty >> (target + forward) & 1:
+            targets |= 1 << (target + forward)
+
+      if captures:
+        targets |= PAWN_MASKS[color][sq] & enemy
+
+    else:
+      attacks = self.targets_from(sq, code, own | enemy) & ~own
+      targets = 0
+      if captures:
+        targets |= attacks & enemy
+      if quiets:
+        targets |= attacks & empty
+
+    moves = sq << 6
+    for target in squares_of(targets):
+      yield MOVES[moves | target]
+
+  def pseudo_legal_moves(self, color: str, captures: bool=True, quiets: bool=True):
+    for sq in squares_of(self.occupancy[color]):
+      yield from self.moves_from(sq, captures, quiets)
+
+  def is_attacked(self, sq: int, by_color: str, occupied: int=None):
+    if occupied is None:
+      occupied = self.occupancy['w'] | self.occupancy['b']
+
+    sign = COLOR_SIGN[by_color]
+    bitboards = self.bitboards
+
+    if PAWN_MASKS[OTHER_COLOR[by_color]][sq] & bitboards[sign * PAWN]:
+      return True
+    if KNIGHT_MASKS[sq] & bitboards[sign * KNIGHT]:
+      return True
+    if KING_MASKS[sq] & bitboards[sign * KING]:
+      return True
+
+    queens = bitboards[sign * QUEEN]
+    if rook_attacks(sq, occupied) & (bitboards[sign * ROOK] | queens):
+      return True
+    if bishop_attacks(sq, occupied) & (bitboards[sign * BISHOP] | queens):
+      return True
+
+    return False
+
+  def is_safe_for_king(self, color: str, sq: int):
+    # Lift the King off the occupancy, so it does not shield the square
+    # it is about to leave.
+    occupied = (self.occupancy['w'] | self.occupancy['b']) & ~(1 << self.king_squares[color])
+    return not self.is_attacked(sq, OTHER_COLOR[color], occupied)
+
+# The board implementations to choose from, by name
+BACKENDS = {
+  'array': Chessboard,
+  'bitboard': BitboardChessboard,
+}
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import sys
+
+# Rough cost of one OrderedDict slot (hash table entry plus linked list node),
+# on top of the key and value objects themselves.
+ENTRY_OVERHEAD = 100
+
+"""
+Least-recently-used cache with a hard budget on both the number of entries
+and their (estimated) size in bytes. When either budget is exceeded, the
+least recently used entries are evicted until both fit again.
+
+Works as a dict through get/put, and as a set through add/in. Every lookup
+counts as a hit or a miss, and every eviction is counted too.
+"""
+class BoundedCache:
+  def __init__(self, max_entries: int, max_bytes: int):
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.bytes = 0
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    if key in self.entries:
+      self.entries.move_to_end(key)
+      self.hits += 1
+      return True
+
+    self.misses += 1
+    return False
+
+  def get(self, key, default=None):
+    value = self.entries.get(key, self)
+    if value is self:
+      self.misses += 1
+      return default
+
+    self.entries.move_to_end(key)
+    self.hits += 1
+    return value
+
+  def put(self, key, value):
+    if key in self.entries:
+      self.bytes -= sys.getsizeof(self.entries[key])
+      self.entries.move_to_end(key)
+    else:
+      self.bytes += ENTRY_OVERHEAD + sys.getsizeof(key)
+
+    self.entries[key] = value
+    self.bytes += sys.getsizeof(value)
+
+    while (len(self.entries) > self.max_entries
+      or self.bytes > self.max_bytes):
+      old_key, old_value = self.entries.popitem(last=False)
+      self.bytes -= ENTRY_OVERHEAD + sys.getsizeof(old_key) + sys.getsizeof(old_value)
+      self.evictions += 1
+
+  def add(self, key):
+    self.put(key, True)
+
+  def clear(self):
+    self.entries.clear()
+    self.bytes = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'entries': len(self.entries),
+      'bytes': self.bytes,
+      'hits': self.hits,
+      'misses': self.misses,
+      'evictions': self.evictions,
+      'hit_rate': self.hits / lookups if lookups else 0.0,
+    }
@@ -1,5 +1,9 @@
 from pieces import *
-import copy
+from cache import BoundedCache
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_FORWARD, RAYS, ORTHOGONAL, DIAGONAL
+from typing import NamedTuple
+from array import array
+import zobrist
 
 class Ccolor:
   HEADER = '\033[95m'
@@ -14,6 +18,30 @@ class Ccolor:
 
 INDEX_TO_LETTER = ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']
 
+# Budget of every one of the position caches kept by Chessboard
+CACHE_MAX_ENTRIES = 2**18
+CACHE_MAX_BYTES = 32 * 2**20
+
+OTHER_COLOR = {
+  'w': 'b',
+  'b': 'w',
+}
+
+# FEN letters: upper case for White, lower case for Black
+FEN_LETTERS = {
+  sign * kind: letter if sign > 0 else letter.lower()
+  for kind, letter in zip(range(PAWN, KING + 1), 'PNBRQK')
+  for sign in (1, -1)
+}
+FEN_CODES = {letter: code for code, letter in FEN_LETTERS.items()}
+
+# Which of the ray directions in attacks.py each slider moves along
+SLIDER_DIRECTIONS = {
+  BISHOP: DIAGONAL,
+  ROOK: ORTHOGONAL,
+  QUEEN: DIAGONAL + ORTHOGONAL,
+}
+
 INITIAL_BOARD = [
   [Rook('b'),   Knight('b'), Bishop('b'), Queen('b'),  King('b'),   Bishop('b'), Knight('b'), Rook('b')],
   [Pawn('b'),   Pawn('b'),   Pawn('b'),   Pawn('b'),   Pawn('b'),   Pawn('b'),   Pawn('b'),   Pawn('b')],
@@ -25,25 +53,6 @@ INITIAL_BOARD = [
   [Rook('w'),   Knight('w'), Bishop('w'), Queen('w'),  King('w'),  Bishop('w'), Knight('w'), Rook('w')],
 ]
 
-INITIAL_INVENTORY = {
-  'b': {
-    Pawn: 8,
-    Knight: 2,
-    Bishop: 2,
-    Rook: 2,
-    Queen: 1,
-    King: 1,
-  },
-  'w': {
-    Pawn: 8,
-    Knight: 2,
-    Bishop: 2,
-    Rook: 2,
-    Queen: 1,
-    King: 1,
-  }
-}
-
 # Based on GM Larry Kaufman's analysis:
 # Available at: https://www.danheisman.com/evaluation-of-material-imbalances.html
 PIECE_VALUE = {
@@ -122,58 +131,181 @@ PIECE_SQUARE_TABLES = {
   ],
 }
 
+"""
+PIECE_VALUE and PIECE_SQUARE_TABLES folded into one signed number per
+piece code per square y * 8 + x: what that piece standing on that square
+adds to evaluate(). Black's entries are negated and read from the
+vertically flipped table.
+"""
+SQUARE_SCORES = {
+  sign * kind: [
+    sign * (PIECE_VALUE[PIECE_TYPES[kind]] + PIECE_SQUARE_TABLES[PIECE_TYPES[kind]][abs(y - flip)][x])
+    for y in range(8) for x in range(8)
+  ]
+  for kind in range(PAWN, KING + 1)
+  for sign, flip in ((1, 0), (-1, 7))
+}
+
+def bishop_pair_bonus(color: str, bishops: int):
+  if bishops != 2:
+    return 0
+
+  return PIECE_VALUE['BISHOP_PAIR_BONUS'] if color == 'w' else -PIECE_VALUE['BISHOP_PAIR_BONUS']
+
+"""
+Everything make_move needs to put a position back the way it found it.
+Pieces are piece codes and squares are square numbers; capture_index is
+where the captured piece stood in its side's piece list.
+"""
+class Undo(NamedTuple):
+  move: Move
+  moved: int
+  captured: int
+  capture_index: int
+  king_square: int
+  hash: int
+  eval: int
+  last_move: Move
+
 class Chessboard:
   safe_positions = {
-    'b': set(),
-    'w': set(),
+    'b': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
+    'w': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
   }
   no_checkmate_positions = {
-    'b': set(),
-    'w': set(),
+    'b': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
+    'w': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
   }
   checkmate_positions = {
-    'b': set(),
-    'w': set(),
+    'b': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
+    'w': BoundedCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES),
   }
-  evaluated_positions = {}
 
+  # When set, every evaluate() checks the incrementally kept score against a
+  # full recomputation. Far too slow to leave on outside of debugging.
+  debug_eval = False
+
+  # How many times a side was tested for check, by is_check or by
+  # checks_and_pins. Only read by the search statistics.
+  check_tests = 0
+
+  """
+  The board is a flat array of piece codes (see pieces.py), one per square
+  y * 8 + x. Each side also keeps a list of the squares its pieces stand
+  on, so that generating moves does not have to scan all 64 squares, and
+  the square its King stands on.
+
+  Coord and Piece objects only appear at the edges: piece_in, empty_in and
+  friends hand out shared Piece instances for the game and the tests.
+  """
   def __init__(self, last_move: Move=None):
-    self.board = INITIAL_BOARD
-    self.inventory = INITIAL_INVENTORY
-    self.king_coords = {
-      'w': Coord(7, 4),
-      'b': Coord(0, 4)
+    self.setup([piece_code(piece) for row in INITIAL_BOARD for piece in row], 'w')
+
+  """
+  Sets up the position from 64 piece codes, square y * 8 + x first, and the
+  side to move. Everything kept incrementally afterwards is built here.
+  """
+  def setup(self, codes, turn: str):
+    self.squares = array('b', codes)
+    self.piece_lists = {
+      color: [sq for sq, code in enumerate(self.squares) if code * sign > 0]
+      for color, sign in COLOR_SIGN.items()
+    }
+    self.inventory = {
+      color: {
+        PIECE_TYPES[kind]: sum(1 for code in self.squares if code == sign * kind)
+        for kind in range(PAWN, KING + 1)
+      }
+      for color, sign in COLOR_SIGN.items()
+    }
+    self.king_squares = {
+      color: self.squares.index(sign * KING)
+      for color, sign in COLOR_SIGN.items()
     }
     self.last_move = None
-    self.hash = hash(self)
+    self.turn = turn
+    self.eval = self.compute_eval()
+    self.hash = self.compute_hash()
 
+  """
+  Board from the first two fields of a FEN string: piece placement and side
+  to move. Castling rights, en passant and the move clocks are ignored, as
+  the engine does not play those rules.
+  """
+  @classmethod
+  def from_fen(cls, fen: str):
+    placement, turn = fen.split()[:2]
+
+    codes = []
+    for rank in placement.split('/'):
+      for char in rank:
+        if char.isdigit():
+          codes.extend([EMPTY] * int(char))
+        else:
+          codes.append(FEN_CODES[char])
+
+    board = cls.__new__(cls)
+    board.setup(codes, turn)
+    return board
+
+  def to_fen(self):
+    ranks = []
+    for y in range(8):
+      rank, empties = '', 0
+      for code in self.squares[y * 8:y * 8 + 8]:
+        if code == EMPTY:
+          empties += 1
+          continue
+        if empties:
+          rank += str(empties)
+          empties = 0
+        rank += FEN_LETTERS[code]
+      if empties:
+        rank += str(empties)
+      ranks.append(rank)
+
+    return f"{'/'.join(ranks)} {self.turn} - - 0 1"
+
+  """
+  The Zobrist key of the position. It is kept up to date by make_move and
+  unmake_move, so this is just an attribute read.
+  """
   def __hash__(self):
-    tup = tuple()
-    for row in self.board:
-      tup_of_str = tuple()
-      for piece in row:
-        tup_of_str += tuple(piece.__str__())
-      tup += tup_of_str
-    
-    return hash(tup)
+    return self.hash
+
+  """
+  Builds the Zobrist key of the position from scratch. Only needed when a
+  board is set up; after that make_move updates the key with a few XORs.
+  """
+  def compute_hash(self):
+    key = 0
+    for sq, code in enumerate(self.squares):
+      if code != EMPTY:
+        key ^= zobrist.PIECE_KEYS[code][sq]
+
+    if self.turn == 'b':
+      key ^= zobrist.SIDE_TO_MOVE
+
+    return key
+
+  @property
+  def king_coords(self):
+    return {color: COORDS[sq] for color, sq in self.king_squares.items()}
+
+  def piece_at(self, sq: int):
+    return PIECE_OF_CODE[self.squares[sq]]
 
   def piece_in(self, coord: Coord):
-    return self.board[coord.y][coord.x]
+    return PIECE_OF_CODE[self.squares[coord.y * 8 + coord.x]]
 
   def empty_in(self, coord: Coord):
-    return type(self.board[coord.y][coord.x]) == Empty
+    return self.squares[coord.y * 8 + coord.x] == EMPTY
 
   def friend_in(self, color, coord: Coord):
-    if self.empty_in(coord):
-      return False
-
-    return self.piece_in(coord).color == color
+    return self.squares[coord.y * 8 + coord.x] * COLOR_SIGN[color] > 0
 
   def enemy_in(self, color, coord: Coord):
-    if self.empty_in(coord):
-      return False
-
-    return self.piece_in(coord).color != color
+    return self.squares[coord.y * 8 + coord.x] * COLOR_SIGN[color] < 0
 
   """
   By default, black is rendered on top, white on bottom.
@@ -189,18 +321,18 @@ class Chessboard:
     if self.last_move is None: 
       for y in range(start, end, step):
         for x in range(start, end, step):
-            res += f"{self.board[y][x]} "
+            res += f"{self.piece_in(Coord(y, x))} "
         res += f" {8 - y}\n"
     
     else:
       for y in range(start, end, step):
         for x in range(start, end, step):
           if Coord(y, x) == self.last_move.from_coord:
-            res += f"{Ccolor.OKBLUE}{self.board[y][x]}{Ccolor.ENDC} "
+            res += f"{Ccolor.OKBLUE}{self.piece_in(Coord(y, x))}{Ccolor.ENDC} "
           elif Coord(y, x) == self.last_move.to_coord:
-            res += f"{Ccolor.WARNING}{self.board[y][x]}{Ccolor.ENDC} "
+            res += f"{Ccolor.WARNING}{self.piece_in(Coord(y, x))}{Ccolor.ENDC} "
           else:
-            res += f"{self.board[y][x]} "
+            res += f"{self.piece_in(Coord(y, x))} "
         res += f" {8 - y}\n"
 
     for i in range(start, end, step):
@@ -210,177 +342,330 @@ class Chessboard:
     print(res)
 
   """
-  The flow of a single game tree node expansion looks like this:
-  - is_double_check?
-  - generate pseudolegal moves & positions.
-  - is_check?
-  - Yes -> make_move
-  - recurse.
+  Pseudolegal moves of the piece standing on square sq, worked out on piece
+  codes. They come in the same order as the piece's valid_moves would give
+  them.
   """
-  def legal_positions(self, color: str):
-    res = [] # Resultant moves[]
+  def moves_from(self, sq: int, captures: bool=True, quiets: bool=True):
+    squares = self.squares
+    code = squares[sq]
+    kind = abs(code)
+    sign = 1 if code > 0 else -1
+    moves = sq << 6
+
+    if kind == PAWN:
+      color = 'w' if sign > 0 else 'b'
+      forward = 8 * PAWN_FORWARD[color]
+      target = sq + forward
+
+      # A pawn on the last rank has nowhere left to go
+      if not 0 <= target < 64:
+        return
+
+      if quiets and squares[target] == EMPTY:
+        # Pawn is in starting position
+        if (sq >> 3 == (6 if sign > 0 else 1)
+          and squares[target + forward] == EMPTY):
+          yield MOVES[moves | target + forward]
+
+        yield MOVES[moves | target]
+
+      if captures:
+        for target in PAWN_ATTACKS[color][sq]:
+          if squares[target] * sign < 0:
+            yield MOVES[moves | target]
+
+    elif kind == KNIGHT or kind == KING:
+      for target in (KNIGHT_ATTACKS if kind == KNIGHT else KING_ATTACKS)[sq]:
+        other = squares[target]
+
+        if other == EMPTY:
+          if quiets:
+            yield MOVES[moves | target]
+
+        elif captures and other * sign < 0:
+          yield MOVES[moves | target]
 
-    # Double check using last_move
-    # if (self.is_double_check()):
-    #   king_coords = self.king_coords[color] if color == 'w' else self.king_coords[color]
-    #   king = self.piece_in(king_coords)
+    else:
+      rays = RAYS[sq]
+      for direction in SLIDER_DIRECTIONS[kind]:
+        for target in rays[direction]:
+          other = squares[target]
+
+          if other == EMPTY:
+            if quiets:
+              yield MOVES[moves | target]
+            continue
+
+          if captures and other * sign < 0:
+            yield MOVES[moves | target]
+          break
 
-    #   for valid_move in king.valid_moves((king_coords)):
-    #     position = self.make_move(valid_move)
+  """
+  Every pseudolegal move of color's pieces, generated one at a time.
+  captures and quiets select which kinds of moves are wanted.
+  """
+  def pseudo_legal_moves(self, color: str, captures: bool=True, quiets: bool=True):
+    for sq in self.piece_lists[color]:
+      yield from self.moves_from(sq, captures, quiets)
 
-    #     if not position.is_check():
-    #       res.append(position)
+  """
+  Whether move is one color's pieces could make here, checks aside.
+  """
+  def is_pseudo_legal(self, color: str, move: Move):
+    from_sq = move.from_coord.y * 8 + move.from_coord.x
+    if self.squares[from_sq] * COLOR_SIGN[color] <= 0:
+      return False
 
-    # Non-double check
-    for y in range(8):
-      for x in range(8):
-        piece = self.piece_in(Coord(y, x))
-        if type(piece) == Empty: continue
-        if piece.color != color: continue
+    return move in self.moves_from(from_sq)
 
-        for move in piece.valid_moves(self, Coord(y, x)):
-          chessboard = self.make_move(move)
+  """
+  A pseudolegal move is legal if it does not leave color's King in check.
+  This is the slow but obviously correct way to find out: play the move
+  and look. legal_moves knows better, this is here to check it against.
+  """
+  def is_legal(self, color: str, move: Move):
+    undo = self.make_move(move)
+    is_legal = not self.is_check(color)
+    self.unmake_move(undo)
 
-          if not chessboard.is_check(color):
-            res.append(chessboard)
+    return is_legal
 
-    return res
-          
+  """
+  Called before the searches further down the game tree.
 
+  Finds the enemy pieces giving check to color's King, and color's pieces
+  pinned to the King. Returns (checkers, evasions, pins), as square numbers:
+  - checkers: squares of the pieces giving check.
+  - evasions: when in check, the squares a piece other than the King may
+    move to: the checker's square, and the squares between a sliding
+    checker and the King. None when not in check.
+  - pins: for every pinned piece's square, the squares along the pin it
+    may still move to, up to and including the pinning piece.
   """
-  Called to verify if the last move was legal or not.
+  def checks_and_pins(self, color: str):
+    self.check_tests += 1
+    squares = self.squares
+    sq = self.king_squares[color]
+    sign = COLOR_SIGN[color]
+
+    checkers = []
+    evasions = None
+    pins = {}
+
+    for target in PAWN_ATTACKS[color][sq]:
+      if squares[target] == -sign * PAWN:
+        checkers.append(target)
+        evasions = {target}
+
+    for target in KNIGHT_ATTACKS[sq]:
+      if squares[target] == -sign * KNIGHT:
+        checkers.append(target)
+        evasions = {target}
+
+    rays = RAYS[sq]
+    for direction in range(8):
+      sliders = (-sign * ROOK, -sign * QUEEN) if direction in ORTHOGONAL \
+        else (-sign * BISHOP, -sign * QUEEN)
+      ray = rays[direction]
+      pinned = None
+
+      for i, target in enumerate(ray):
+        code = squares[target]
+        if code == EMPTY:
+          continue
 
-  Last move was legal if it does not place P King under a check.
+        # The first friend along the ray might be pinned; a second one
+        # shields the first.
+        if code * sign > 0:
+          if pinned is None:
+            pinned = target
+            continue
+          break
+
+        if code in sliders:
+          if pinned is None:
+            checkers.append(target)
+            evasions = set(ray[:i + 1])
+          else:
+            pins[pinned] = set(ray[:i + 1])
+        break
+
+    # In double check only the King can move
+    if len(checkers) > 1:
+      evasions = set()
+
+    return checkers, evasions, pins
+
+  """
+  Whether color's King could stand on square sq without being in check.
+  The King is lifted off the board while we look, so that it does not
+  block a slider attacking through the square it is about to leave.
   """
-  def is_check(self, color):    
-    k_y, k_x = self.king_coords[color].y, self.king_coords[color].x
+  def is_safe_for_king(self, color: str, sq: int):
+    king_sq = self.king_squares[color]
+    king = self.squares[king_sq]
 
-    if self.hash in self.known_to_be_safe(color):
-      return False
+    self.squares[king_sq] = EMPTY
+    is_safe = not self.is_attacked(sq, OTHER_COLOR[color])
+    self.squares[king_sq] = king
 
-    if color == 'w':
-      # King y and King x. Just to save us time and space indexing throughout this func
-      
-      # Imagine a White pawn in the place of White king
-      # If move causes Pawn to take: E Queen or E Bishop or E Pawn, return False.
-      # threat y, threat x
-      threat_coords = (
-        (k_y - 1, k_x + 1), # North-east
-        (k_y - 1, k_x - 1), # North-west
-      )
-      for t_y, t_x in threat_coords:
-        if (Coord.is_in_bounds(t_y, t_x)
-          and self.enemy_in(color, Coord(t_y, t_x))
-          and type(self.piece_in(Coord(t_y, t_x))) in (Pawn, Bishop, Queen)):
-            return True
+    return is_safe
 
-    else:
+  """
+  The flow of a single game tree node expansion looks like this:
+  - find checkers and pinned pieces.
+  - double check? Only generate King moves.
+  - generate pseudolegal moves, one stage at a time.
+  - King moves are legal if the target square is not attacked.
+  - Other moves are legal if they answer the check (when in check), and
+    stay on the pin line (when pinned). Anything else is legal as it is.
+  - recurse.
 
-      # Now, imagine a Black pawn
-      threat_coords = (
-        (k_y + 1, k_x + 1), # South-east
-        (k_y + 1, k_x - 1), # South-west
-      )
-      for t_y, t_x in threat_coords:
-        if (Coord.is_in_bounds(t_y, t_x)
-          and self.enemy_in(color, Coord(t_y, t_x))
-          and type(self.piece_in(Coord(t_y, t_x))) in (Pawn, Bishop, Queen)):
-          return True
+  Moves are generated lazily in three stages: the hash move, captures, then
+  quiet moves. A stage is only generated once the consumer has exhausted
+  the stages before it, so a cutoff on the hash move or on a capture means
+  the quiet moves are never generated at all; with quiets off, they never
+  are either way. Within a stage, ordering
+  (a MoveOrderer) decides which move comes first; without one, moves come
+  in board scan order.
 
+  The board must be back in the same position every time the generator is
+  resumed, which is the case as long as every make_move is unmade.
+  """
+  def legal_moves(self, color: str, hash_move: Move=None,
+    ordering: 'MoveOrderer'=None, ply: int=0, quiets: bool=True):
 
-    # Replace P King with P Knight.
-    # If move causes Knight to take: E Knight, return False.
-    threat_coords = (
-      (k_y - 2, k_x + 1),
-      (k_y - 1, k_x + 2),
-      (k_y + 1, k_x + 2),
-      (k_y + 2, k_x + 1),
-      (k_y + 2, k_x - 1),
-      (k_y + 1, k_x - 2),
-      (k_y - 1, k_x - 2),
-      (k_y - 2, k_x - 1),
-    )
-    for t_y, t_x in threat_coords:
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.enemy_in(color, Coord(t_y, t_x))
-        and type(self.piece_in(Coord(t_y, t_x))) is Knight):
-        return True
+    king_sq = self.king_squares[color]
+    checkers, evasions, pins = self.checks_and_pins(color)
 
-    # Replace P King with P Bishop: Generate all moves for P Bishop.
-    # If move causes Bishop to take: E Queen or E Bishop, return False.
-    threat_offsets = (
-      (-1, 1), # Move north-east
-      (1, 1), # Move south-east
-      (1, -1), # Move south-west
-      (-1, -1), # Move north-west
-    )
-    
-    for offset in threat_offsets:
-      t_y, t_x = k_y, k_x
+    def is_legal(move: Move):
+      from_c, to_c = move.from_coord, move.to_coord
+      from_sq, to_sq = from_c.y * 8 + from_c.x, to_c.y * 8 + to_c.x
 
-      while True:
-        t_y, t_x = t_y + offset[0], t_x + offset[1]
+      if from_sq == king_sq:
+        return self.is_safe_for_king(color, to_sq)
 
-        if not Coord.is_in_bounds(t_y, t_x):
-          break
+      if evasions is not None and to_sq not in evasions:
+        return False
 
-        t_c = Coord(t_y, t_x)
+      pin = pins.get(from_sq)
+      if pin is not None and to_sq not in pin:
+        return False
 
-        if self.friend_in(color, t_c):
-          break
+      return True
 
-        if (self.enemy_in(color, t_c)
-          and type(self.piece_in(t_c)) in (Queen, Bishop)):
-          return True
+    def generate(captures: bool, quiets: bool):
+      # Double check
+      if len(checkers) > 1:
+        return self.moves_from(king_sq, captures, quiets)
 
-    # Replace P King with P Rook: Generate all moves for P Rook.
-    # If move causes Rook to take: E Queen or E Rook, return False.
-    threat_offsets = (
-      (-1, 0), # Move north
-      (0, 1), # Move east
-      (1, 0), # Move south
-      (0, -1), # Move west
-    )
-    for offset in threat_offsets:
-      t_y, t_x = k_y, k_x
-
-      while True:
-        t_y, t_x = t_y + offset[0], t_x + offset[1]
-
-        if not Coord.is_in_bounds(t_y, t_x):
-          break
+      return self.pseudo_legal_moves(color, captures, quiets)
 
-        t_c = Coord(t_y, t_x)
+    # The hash move may come from a different position with the same hash,
+    # so it has to be checked before it is played.
+    if hash_move is not None:
+      if self.is_pseudo_legal(color, hash_move) and is_legal(hash_move):
+        yield hash_move
+      else:
+        hash_move = None
 
-        if self.friend_in(color, t_c):
-          break
+    captures = generate(True, False)
+    if ordering is not None:
+      captures = ordering.order_captures(self, captures)
 
-        if (self.enemy_in(color, t_c)
-          and type(self.piece_in(t_c)) in (Queen, Rook)):
-          return True
+    for move in captures:
+      if hash_move is not None and move == hash_move: continue
+      if is_legal(move):
+        yield move
+
+    if not quiets:
+      return
+
+    quiet_moves = generate(False, True)
+    if ordering is not None:
+      quiet_moves = ordering.order_quiets(self, quiet_moves, ply)
+
+    for move in quiet_moves:
+      if hash_move is not None and move == hash_move: continue
+      if is_legal(move):
+        yield move
+
+  """
+  Same as legal_moves, but every resultant position is handed back as its
+  own snapshot. Only use this when you really need the boards: the search
+  works on a single board through make_move and unmake_move.
+  """
+  def legal_positions(self, color: str):
+    return [self.position_after(move) for move in self.legal_moves(color)]
 
-    # Replace P King: Generate all moves for P King.
-    # If more causes King to take: E King, return False.
-    threat_coords = (
-      (k_y - 2, k_x + 1),
-      (k_y - 1, k_x + 2),
-      (k_y + 1, k_x + 2),
-      (k_y + 2, k_x + 1),
-      (k_y + 2, k_x - 1),
-      (k_y + 1, k_x - 2),
-      (k_y - 1, k_x - 2),
-      (k_y - 2, k_x - 1),
-    )
-    for t_y, t_x in threat_coords:
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.enemy_in(color, Coord(t_y, t_x))
-        and type(self.piece_in(Coord(t_y, t_x))) is King):
+  """
+  Whether any of by_color's pieces attacks square sq (y * 8 + x). Rather
+  than generating by_color's moves, look outward from the square itself: a
+  knight stands on one of its knight squares, a pawn on one of its pawn
+  squares, and so on.
+  """
+  def is_attacked(self, sq: int, by_color: str):
+    squares = self.squares
+    sign = COLOR_SIGN[by_color]
+
+    # A pawn of by_color attacks sq if a pawn of the other color standing
+    # on sq would attack the pawn back.
+    pawn = sign * PAWN
+    for target in PAWN_ATTACKS[OTHER_COLOR[by_color]][sq]:
+      if squares[target] == pawn:
         return True
 
-    # Not threatened by king.
+    knight = sign * KNIGHT
+    for target in KNIGHT_ATTACKS[sq]:
+      if squares[target] == knight:
+        return True
 
-    # The function hasn't returned thus far. This means the board
-    # is safe.
+    king = sign * KING
+    for target in KING_ATTACKS[sq]:
+      if squares[target] == king:
+        return True
+
+    # Sliders: only the first piece along each ray matters
+    rays = RAYS[sq]
+    queen = sign * QUEEN
+
+    rook = sign * ROOK
+    for direction in ORTHOGONAL:
+      for target in rays[direction]:
+        code = squares[target]
+        if code == EMPTY:
+          continue
+        if code == rook or code == queen:
+          return True
+        break
+
+    bishop = sign * BISHOP
+    for direction in DIAGONAL:
+      for target in rays[direction]:
+        code = squares[target]
+        if code == EMPTY:
+          continue
+        if code == bishop or code == queen:
+          return True
+        break
+
+    return False
+
+  """
+  Called to verify if the last move was legal or not.
+
+  Last move was legal if it does not place P King under a check.
+  """
+  def is_check(self, color):
+    self.check_tests += 1
+    if self.hash in self.known_to_be_safe(color):
+      return False
+
+    if self.is_attacked(self.king_squares[color], OTHER_COLOR[color]):
+      return True
+
+    # The King is not attacked. This means the board is safe.
     self.known_to_be_safe(color).add(self.hash)
 
     return False
@@ -392,18 +677,22 @@ class Chessboard:
       return self.safe_positions[color]
 
   """
-  Called before the searches further down the game tree.
-
-  While is_check considers whether the current player's last move puts
-  their King in check, is_double_check whether the enemy player's last
-  move puts the current player in check.
+  Static evaluation from White's point of view. make_move keeps the score
+  up to date as pieces move and get captured, so this costs nothing.
   """
-  # def is_double_check(self, last_move):
-
   def evaluate(self):
-    if self.hash in self.evaluated_positions:
-      return self.evaluated_positions[self.hash]
+    if self.debug_eval:
+      expected = self.compute_eval()
+      assert self.eval == expected, \
+        f"Incremental evaluation {self.eval} differs from full evaluation {expected}"
+
+    return self.eval
 
+  """
+  Evaluates the position from scratch. Used to set up a board's running
+  score, and to check it in debug_eval mode.
+  """
+  def compute_eval(self):
     aggregate_value = 0
     
     # Static piece value evaluations
@@ -439,51 +728,198 @@ class Chessboard:
           # PST[Pawn][3][3] == 15, not PST[Pawn][4][3] == 10.
           aggregate_value -= PIECE_SQUARE_TABLES[type(piece)][abs(y - 7)][x]
 
-    # Memoize the result of the evaluation
-    self.evaluated_positions[self.hash] = aggregate_value
-
     return aggregate_value
-      
+
+  """
+  Plays move on this board in place and returns the Undo record that
+  unmake_move needs to take it back. Moves must be unmade in the reverse
+  order they were made in.
+  """
   def make_move(self, move: Move):
-    new_chessboard = copy.deepcopy(self)
-    new_chessboard.last_move = move
-
-    # No attack
-    if new_chessboard.empty_in(move.to_coord):
-      new_chessboard.board[move.from_coord.y][move.from_coord.x], \
-      new_chessboard.board[move.to_coord.y][move.to_coord.x] =    \
-      new_chessboard.board[move.to_coord.y][move.to_coord.x],     \
-      new_chessboard.board[move.from_coord.y][move.from_coord.x]
-    
+    from_c, to_c = move.from_coord, move.to_coord
+    from_sq, to_sq = from_c.y * 8 + from_c.x, to_c.y * 8 + to_c.x
+    squares = self.squares
+
+    moved = squares[from_sq]
+    captured = squares[to_sq]
+    color = 'w' if moved > 0 else 'b'
+    king_square = self.king_squares[color]
+    capture_index = -1
+
+    square_scores = SQUARE_SCORES[moved]
+    score = self.eval + square_scores[to_sq] - square_scores[from_sq]
+
+    # XOR the moved piece out of its old square and into its new one, and
+    # flip the side to move.
+    piece_keys = zobrist.PIECE_KEYS[moved]
+    key = self.hash ^ zobrist.SIDE_TO_MOVE ^ piece_keys[from_sq] ^ piece_keys[to_sq]
+
+    movers = self.piece_lists[color]
+    movers[movers.index(from_sq)] = to_sq
+
     # Attack move
-    else:
-      new_chessboard.inventory[new_chessboard.piece_in(move.to_coord).color][type(new_chessboard.piece_in(move.to_coord))] -= 1
-      new_chessboard.board[move.to_coord.y][move.to_coord.x] = \
-      new_chessboard.board[move.from_coord.y][move.from_coord.x]
-      new_chessboard.board[move.from_coord.y][move.from_coord.x] = Empty()
+    if captured != EMPTY:
+      enemy = OTHER_COLOR[color]
+      victims = self.piece_lists[enemy]
+      capture_index = victims.index(to_sq)
+      del victims[capture_index]
+
+      piece_type = PIECE_TYPES[abs(captured)]
+      inventory = self.inventory[enemy]
+      left = inventory[piece_type] - 1
+      inventory[piece_type] = left
+
+      score -= SQUARE_SCORES[captured][to_sq]
+      if piece_type is Bishop:
+        score += bishop_pair_bonus(enemy, left) - bishop_pair_bonus(enemy, left + 1)
+
+      key ^= zobrist.PIECE_KEYS[captured][to_sq]
+
+    squares[to_sq] = moved
+    squares[from_sq] = EMPTY
+
+    # If either King is moved, update his position.
+    if abs(moved) == KING:
+      self.king_squares[color] = to_sq
+
+    undo = Undo(move, moved, captured, capture_index, king_square,
+      self.hash, self.eval, self.last_move)
+
+    self.last_move = move
+    self.turn = OTHER_COLOR[self.turn]
+    self.hash = key
+    self.eval = score
+
+    return undo
 
-    # If either King is moved, update his position in new_chessboard.
-    moved = new_chessboard.piece_in(move.to_coord)
+  def unmake_move(self, undo: Undo):
+    from_c, to_c = undo.move.from_coord, undo.move.to_coord
+    from_sq, to_sq = from_c.y * 8 + from_c.x, to_c.y * 8 + to_c.x
+    color = 'w' if undo.moved > 0 else 'b'
 
-    if (type(moved) is King):
-      new_chessboard.king_coords[moved.color] = move.to_coord
+    self.squares[from_sq] = undo.moved
+    self.squares[to_sq] = undo.captured
 
-    # Update the hash of the new chessboard
-    new_chessboard.hash = hash(new_chessboard)
+    movers = self.piece_lists[color]
+    movers[movers.index(to_sq)] = from_sq
+
+    if undo.captured != EMPTY:
+      enemy = OTHER_COLOR[color]
+      self.piece_lists[enemy].insert(undo.capture_index, to_sq)
+      self.inventory[enemy][PIECE_TYPES[abs(undo.captured)]] += 1
+
+    self.king_squares[color] = undo.king_square
+    self.last_move = undo.last_move
+    self.turn = OTHER_COLOR[self.turn]
+    self.hash = undo.hash
+    self.eval = undo.eval
+
+  """
+  Passes the turn without moving anything, for null-move pruning. Returns
+  what unmake_null_move needs to take it back.
+  """
+  def make_null_move(self):
+    last_move = self.last_move
+    self.hash ^= zobrist.SIDE_TO_MOVE
+    self.last_move = None
+    self.turn = OTHER_COLOR[self.turn]
+
+    return last_move
+
+  def unmake_null_move(self, last_move: Move):
+    self.hash ^= zobrist.SIDE_TO_MOVE
+    self.last_move = last_move
+    self.turn = OTHER_COLOR[self.turn]
+
+  """
+  An independent copy of this position.
+  """
+  def snapshot(self):
+    new_chessboard = self.__class__.__new__(self.__class__)
+    new_chessboard.squares = array('b', self.squares)
+    new_chessboard.piece_lists = {
+      color: list(squares) for color, squares in self.piece_lists.items()
+    }
+    new_chessboard.inventory = {
+      color: dict(counts) for color, counts in self.inventory.items()
+    }
+    new_chessboard.king_squares = dict(self.king_squares)
+    new_chessboard.last_move = self.last_move
+    new_chessboard.turn = self.turn
+    new_chessboard.eval = self.eval
+    new_chessboard.hash = self.hash
 
     return new_chessboard
 
+  """
+  Snapshot of the position reached by playing move. This board is left
+  untouched.
+  """
+  def position_after(self, move: Move):
+    undo = self.make_move(move)
+    position = self.snapshot()
+    self.unmake_move(undo)
+
+    return position
+
   def is_checkmate(self, color):
-    if self.hash in self.checkmate_positions:
+    if self.hash in self.checkmate_positions[color]:
       return True
 
-    if self.hash in self.no_checkmate_positions:
+    if self.hash in self.no_checkmate_positions[color]:
       return False
 
-    if self.legal_positions(color) == []:
+    if next(self.legal_moves(color), None) is None:
       self.checkmate_positions[color].add(self.hash)
       return True
     
     else:
       self.no_checkmate_positions[color].add(self.hash)
       return False
+
+  """
+  Counts the leaf nodes of the legal move tree depth plies deep, from the
+  side to move. The standard way to test move generation, and to measure
+  how fast it is.
+  """
+  def perft(self, depth: int):
+    if depth == 0:
+      return 1
+
+    moves = self.legal_moves(self.turn)
+
+    # Bulk counting: the leaves need not be played, only counted
+    if depth == 1:
+      return sum(1 for _ in moves)
+
+    nodes = 0
+    for move in moves:
+      undo = self.make_move(move)
+      nodes += self.perft(depth - 1)
+      self.unmake_move(undo)
+
+    return nodes
+
+  """
+  perft split by root move, to find which move a wrong count hides under.
+  Returns {move notation: nodes}.
+  """
+  def divide(self, depth: int):
+    res = {}
+    for move in self.legal_moves(self.turn):
+      undo = self.make_move(move)
+      res[move.notation()] = self.perft(depth - 1)
+      self.unmake_move(undo)
+
+    return res
+
+  """
+  Hit, miss and eviction counters of every position cache, by cache name.
+  """
+  @classmethod
+  def cache_stats(cls):
+    return {
+      'safe_positions': {color: cache.stats() for color, cache in cls.safe_positions.items()},
+      'no_checkmate_positions': {color: cache.stats() for color, cache in cls.no_checkmate_positions.items()},
+      'checkmate_positions': {color: cache.stats() for color, cache in cls.checkmate_positions.items()},
+    }
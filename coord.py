@@ -1,5 +1,5 @@
 NOTATION_TO_COORDS = {
-  'a8': (0, 0), 'b8': (0, 1), 'c8': (0, 2), 'd8': (0, 3), 'e8': (0, 4), 'f8': (0, 5), 'g8': (0, 6), 'h1': (0, 7),
+  'a8': (0, 0), 'b8': (0, 1), 'c8': (0, 2), 'd8': (0, 3), 'e8': (0, 4), 'f8': (0, 5), 'g8': (0, 6), 'h8': (0, 7),
   'a7': (1, 0), 'b7': (1, 1), 'c7': (1, 2), 'd7': (1, 3), 'e7': (1, 4), 'f7': (1, 5), 'g7': (1, 6), 'h7': (1, 7),
   'a6': (2, 0), 'b6': (2, 1), 'c6': (2, 2), 'd6': (2, 3), 'e6': (2, 4), 'f6': (2, 5), 'g6': (2, 6), 'h6': (2, 7),
   'a5': (3, 0), 'b5': (3, 1), 'c5': (3, 2), 'd5': (3, 3), 'e5': (3, 4), 'f5': (3, 5), 'g5': (3, 6), 'h5': (3, 7),
@@ -9,20 +9,50 @@ NOTATION_TO_COORDS = {
   'a1': (7, 0), 'b1': (7, 1), 'c1': (7, 2), 'd1': (7, 3), 'e1': (7, 4), 'f1': (7, 5), 'g1': (7, 6), 'h1': (7, 7),
 }
 
+"""
+A square of the board. There are only ever 64 of them: Coord(y, x) hands
+out the one shared instance for the square, from COORDS, rather than a new
+object, so coordinates are immutable and compare and hash by square.
+Out of bounds coordinates, which only ever turn up to be rejected, are
+the exception and get an instance of their own.
+"""
 class Coord:
-  def __init__(self, y: int=None, x: int=None, a_n: str=None):
+  __slots__ = ('y', 'x')
+
+  def __new__(cls, y: int=None, x: int=None, a_n: str=None):
     if (a_n is not None):
-      self.y, self.x = NOTATION_TO_COORDS[a_n]
-    else:      
-      self.y = y
-      self.x = x
+      y, x = NOTATION_TO_COORDS[a_n]
+
+    if 0 <= y <= 7 and 0 <= x <= 7:
+      return COORDS[y * 8 + x]
+
+    return cls._make(y, x)
+
+  @classmethod
+  def _make(cls, y: int, x: int):
+    coord = object.__new__(cls)
+    object.__setattr__(coord, 'y', y)
+    object.__setattr__(coord, 'x', x)
+    return coord
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Coord is immutable")
+
+  def __reduce__(self):
+    return Coord, (self.y, self.x)
 
   def __eq__(self, other):
     return self.y == other.y and self.x == other.x
 
+  def __hash__(self):
+    return self.y * 8 + self.x
+
   def __str__(self):
     return f"Coord({self.y}, {self.x})"
 
+  def notation(self):
+    return f"{'abcdefgh'[self.x]}{8 - self.y}"
+
   @staticmethod
   def is_in_bounds(y: int=None, x: int=None, a_n: str=None):
     if (a_n is not None):
@@ -32,4 +62,7 @@ class Coord:
       return 0 <= y <= 7 and 0 <= x <= 7
 
     else:
-      return False
\ No newline at end of file
+      return False
+
+# Square y * 8 + x, like everywhere else
+COORDS = tuple(Coord._make(sq >> 3, sq & 7) for sq in range(64))
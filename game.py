@@ -1,9 +1,19 @@
-from chessboard import Chessboard
+from chessboard import Chessboard, PIECE_VALUE, OTHER_COLOR
+from pieces import Knight, Bishop, Rook, Queen
+from bitboard import BACKENDS
 from coord import Coord
 from move import Move
 from test import dynamic_move_test
+from transposition import TranspositionTable, SharedTranspositionTable, DEFAULT_SIZE_MB, EXACT, LOWER, UPPER
+from ordering import MoveOrderer
+
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor
 
 import multiprocessing as mp
+import json
+import queue
+import sys
 import time
 
 LONGFORM_COLOR = {
@@ -11,81 +21,1059 @@ LONGFORM_COLOR = {
   'b': 'Black'
 }
 
+# How many captures deep quiescence search may go past the depth limit
+DEFAULT_MAX_QDEPTH = 6
+
+# How many nodes the search visits between looking at the stop flag and
+# the clock
+NODES_PER_POLL = 1024
+
+# Half the width of the aspiration window around the previous iteration's
+# score. It doubles every time the score falls outside of it, until it is
+# past ASPIRATION_LIMIT and that side of the window opens up entirely.
+ASPIRATION_WINDOW = 100
+ASPIRATION_LIMIT = 800
+
+# Null-move pruning searches the position after passing the turn this many
+# plies less deep, one more with more than NULL_MOVE_DEEP plies left. A
+# side with nothing but pawns left is too likely to be in zugzwang, where
+# passing would be better than any move, for it to be tried.
+NULL_MOVE_R = 2
+NULL_MOVE_DEEP = 6
+NULL_MOVE_PIECES = (Knight, Bishop, Rook, Queen)
+
+# Late move reductions: quiet moves past the first LMR_MIN_INDEX of a node
+# with at least LMR_MIN_DEPTH plies left are searched a ply less deep, and
+# again in full should they turn out better than expected.
+LMR_MIN_INDEX = 3
+LMR_MIN_DEPTH = 3
+
+# Frontier pruning, with margins by plies left. At FRONTIER_DEPTH plies or
+# less from the horizon:
+# - Futility pruning: when the static score is FUTILITY_MARGINS short of
+#   the bound, quiet moves that do not give check are not searched.
+# - Razoring: when it is RAZOR_MARGINS short, and quiescence search cannot
+#   find a way up to the bound either, the node fails at once.
+FRONTIER_DEPTH = 2
+FUTILITY_MARGINS = (0, 200, 500)
+RAZOR_MARGINS = (0, 300, 600)
+
+# Being mated scores MATE less the ply it happens at, so that the nearer a
+# mate is, the better it scores. Any score past MATE_BOUND is a mate.
+MATE = 1000000
+MATE_BOUND = MATE - 1000
+
+# A capture that would not bring the score within this much of the bound,
+# even after winning the captured piece, is not worth searching.
+DELTA_MARGIN = 200
+
+def is_mate(score):
+  return abs(score) >= MATE_BOUND
+
+"""
+Mate scores count plies from the root, but the transposition table may
+hand an entry out again at another ply. Entries count them from their own
+position instead.
+"""
+def score_to_tt(score, ply: int):
+  if score >= MATE_BOUND:
+    return score + ply
+  if score <= -MATE_BOUND:
+    return score - ply
+  return score
+
+def score_from_tt(score, ply: int):
+  if score >= MATE_BOUND:
+    return score - ply
+  if score <= -MATE_BOUND:
+    return score + ply
+  return score
+
+"""
+What a search hands out for every iteration: moves as Move.encode() codes,
+so that the record stays small however deep the search gets. move is None
+when there is no move to play. nodes counts main search and quiescence
+nodes since the search started, and pv is the line the search expects,
+starting with move.
+"""
+class SearchResult(NamedTuple):
+  move: int
+  score: float
+  depth: int
+  nodes: int
+  pv: list
+
+"""
+An on_iteration callback for AI that writes the statistics of every
+iteration to stream as one line of JSON.
+"""
+def json_lines(stream=None):
+  def write(stats: dict):
+    print(json.dumps(stats), file=stream or sys.stdout, flush=True)
+  return write
+
 class AI:
-  def __init__(self, color: str):
+  def __init__(self, color: str, tt_size_mb: float=DEFAULT_SIZE_MB,
+    max_qdepth: int=DEFAULT_MAX_QDEPTH, on_iteration=None, tt=None):
     self.color = color
+    self.max_qdepth = max_qdepth
+    # Searches that share a table (see LazySMPSearch) hand it in
+    self.tt = tt if tt is not None else TranspositionTable(tt_size_mb)
+    self.ordering = MoveOrderer()
+
+    # Called with the statistics of every finished iteration, see
+    # iteration_stats. Nothing is gathered past the plain counters when unset.
+    self.on_iteration = on_iteration
+
+    # Nodes visited by the main search and by quiescence search
+    self.nodes = 0
+    self.qnodes = 0
+
+    # Principal variation search and aspiration windows can both be turned
+    # off, to compare. The counters are of searches done over with a wider
+    # window, which is the price of both.
+    self.use_pvs = True
+    self.use_aspiration = True
+    self.pvs_researches = 0
+    self.aspiration_researches = 0
+
+    # Selective search, with the same kind of switches. The counters are of
+    # null moves tried, and the cutoffs they gave, and of reduced moves, and
+    # those of them searched again in full.
+    self.use_null_move = True
+    self.use_lmr = True
+    self.null_moves = 0
+    self.null_move_cutoffs = 0
+    self.lmr_reductions = 0
+    self.lmr_researches = 0
+
+    # Frontier and mate distance pruning, and how many times each pruned
+    self.use_futility = True
+    self.use_razoring = True
+    self.use_mate_distance = True
+    self.futility_prunes = 0
+    self.razor_prunes = 0
+    self.mate_distance_prunes = 0
 
-  def get_best_position_ID(self, board: Chessboard, color, return_queue: mp.Queue):
+    # Triangular PV table: the best line found from the node at each depth,
+    # made of the best move there and the line of the node below. The line
+    # of the last iteration is searched first in the next one.
+    self.pv_table = {}
+    self.previous_pv = []
+    self.follow_pv = False
 
+    # The search gives up as soon as it notices the stop event set, or the
+    # deadline (a time.monotonic() value) past. See poll.
+    self.stop_event = None
+    self.deadline = None
+    self.stopped = False
+    self.countdown = NODES_PER_POLL
+
+  """
+  Iterative deepening. Every iteration that completes puts a SearchResult
+  on return_queue, and None follows the last of them once the search is
+  over:
+  - When stop (an mp.Event) is set, or the deadline passes, the iteration
+    underway is abandoned. Its best move so far is still put on the queue
+    if one of the root moves was searched through, or failed high and was
+    being searched again: the move that was best at the previous depth is
+    searched first, so whatever beat it at this depth is the better move. It goes with the depth of the last iteration
+    that completed.
+  - The search also ends after max_depth, on finding a mate, or when there
+    is no move to play.
+  - max_nodes is checked between iterations alone, so that it ends the
+    search on the same iteration on any machine: no iteration starts once
+    that many nodes have been searched.
+
+  From the second iteration on, the root is searched with an aspiration
+  window around the score of the previous one, see search_root.
+  """
+  def get_best_position_ID(self, board: Chessboard, color, return_queue: mp.Queue,
+    stop=None, deadline: float=None, max_depth: int=None, max_nodes: int=None):
+
+    self.tt.new_search()
+    self.ordering.new_search()
+    self.start_search(stop, deadline)
     depth_limit = 0
+    previous = None
+    pv = []
     
-    while True:
+    while max_depth is None or depth_limit < max_depth:
       depth_limit += 1
-      print(f"Depth limit = {depth_limit}")
-      score, best_position = self.get_best_position(board, color, 0, depth_limit)
-      return_queue.put([score, best_position])
+      # On stderr, so that json_lines can have stdout to itself
+      print(f"Depth limit = {depth_limit}", file=sys.stderr)
+
+      if self.on_iteration is not None:
+        before = self.counters(board)
+
+      score, best_move = self.search_root(board, color, depth_limit,
+        score if depth_limit > 1 else None)
+
+      if self.stopped:
+        if best_move is not None:
+          line = self.pv_table.get(0, [])
+          if line and line[0] == best_move:
+            pv = [move.encode() for move in line]
+          # The line of the previous iteration still holds if its first move does
+          elif not pv or pv[0] != best_move.encode():
+            pv = [best_move.encode()]
+          return_queue.put(SearchResult(best_move.encode(), score, depth_limit - 1,
+            self.nodes + self.qnodes, pv))
+        break
+
+      if self.on_iteration is not None:
+        stats = self.iteration_stats(board, depth_limit, score, best_move, before, previous)
+        self.on_iteration(stats)
+        previous = stats
+
+      pv = [move.encode() for move in self.pv_table.get(0, [])]
+      return_queue.put(SearchResult(
+        best_move.encode() if best_move is not None else None, score, depth_limit,
+        self.nodes + self.qnodes, pv))
+
+      if best_move is None or is_mate(score):
+        break
+
+      if max_nodes is not None and self.nodes + self.qnodes >= max_nodes:
+        break
+
+    return_queue.put(None)
+
+  """
+  One iteration of the search, down the line of the previous one first.
+
+  Given the score of the previous iteration, the root is first searched
+  within ASPIRATION_WINDOW of it. A score on the edge of the window only
+  says that the real one lies beyond it, so the window is widened on that
+  side and the root searched again, until the score falls inside.
+  """
+  def search_root(self, board: Chessboard, color, depth_limit: int, previous_score=None):
+    self.previous_pv = self.pv_table.get(0, [])
+    self.pv_table = {}
+
+    if (not self.use_aspiration or previous_score is None
+      or is_mate(previous_score)):
+      self.follow_pv = True
+      return self.get_best_position(board, color, 0, depth_limit)
+
+    delta = ASPIRATION_WINDOW
+    alpha, beta = previous_score - delta, previous_score + delta
+    confirmed = None
+
+    while True:
+      self.follow_pv = True
+      score, best_move = self.get_best_position(board, color, 0, depth_limit, alpha, beta)
+
+      if self.stopped:
+        # A move that failed high is already known to beat the previous best
+        return score, best_move if best_move is not None else confirmed
+
+      if alpha < score < beta:
+        return score, best_move
+
+      self.aspiration_researches += 1
+      delta *= 2
+
+      # Only a side that failed high has a move: White's on score >= beta,
+      # Black's on score <= alpha
+      if best_move is not None:
+        confirmed = best_move
+
+      if score <= alpha:
+        alpha = previous_score - delta if delta <= ASPIRATION_LIMIT else float('-inf')
+      else:
+        beta = previous_score + delta if delta <= ASPIRATION_LIMIT else float('+inf')
 
-    return
+  """
+  Resets the node counters and the stop state before a search.
+  """
+  def start_search(self, stop=None, deadline: float=None):
+    self.nodes = 0
+    self.qnodes = 0
+    self.stop_event = stop
+    self.deadline = deadline
+    self.stopped = False
+    self.countdown = NODES_PER_POLL
+
+  """
+  Called every NODES_PER_POLL nodes. Sets self.stopped once the search
+  should give up; the search then unwinds without trusting, or storing,
+  anything it was in the middle of.
+  """
+  def poll(self):
+    self.countdown = NODES_PER_POLL
+
+    if ((self.stop_event is not None and self.stop_event.is_set())
+      or (self.deadline is not None and time.monotonic() >= self.deadline)):
+      self.stopped = True
+
+  def counters(self, board: Chessboard):
+    return {
+      'time': time.perf_counter(),
+      'nodes': self.nodes,
+      'qnodes': self.qnodes,
+      'cutoffs': self.ordering.cutoffs,
+      'first_move_cutoffs': self.ordering.first_move_cutoffs,
+      'tt_probes': self.tt.probes,
+      'tt_hits': self.tt.hits,
+      'check_tests': board.check_tests,
+      'pvs_researches': self.pvs_researches,
+      'aspiration_researches': self.aspiration_researches,
+      'null_moves': self.null_moves,
+      'null_move_cutoffs': self.null_move_cutoffs,
+      'lmr_reductions': self.lmr_reductions,
+      'lmr_researches': self.lmr_researches,
+      'futility_prunes': self.futility_prunes,
+      'razor_prunes': self.razor_prunes,
+      'mate_distance_prunes': self.mate_distance_prunes,
+    }
+
+  """
+  Statistics of the iteration that searched to depth, out of the counters
+  as they were before it started. Counts are for this iteration alone.
+
+  The branching factor is the effective one: how many times more nodes
+  this iteration took than the one before it.
+  """
+  def iteration_stats(self, board: Chessboard, depth: int, score, best_move,
+    before: dict, previous: dict=None):
+    after = self.counters(board)
+    done = {name: after[name] - before[name] for name in after}
+
+    seconds = done['time']
+    nodes = done['nodes'] + done['qnodes']
+
+    branching_factor = None
+    if previous is not None and previous['nodes'] + previous['qnodes']:
+      branching_factor = round(nodes / (previous['nodes'] + previous['qnodes']), 2)
+
+    return {
+      'depth': depth,
+      'score': score if abs(score) != float('inf') else str(score),
+      'best_move': best_move.notation() if best_move is not None else None,
+      'seconds': round(seconds, 4),
+      'nodes': done['nodes'],
+      'qnodes': done['qnodes'],
+      'nps': round(nodes / seconds) if seconds else None,
+      'cutoffs': done['cutoffs'],
+      'first_move_cutoff_rate':
+        round(done['first_move_cutoffs'] / done['cutoffs'], 3) if done['cutoffs'] else None,
+      'tt_hit_rate': round(done['tt_hits'] / done['tt_probes'], 3) if done['tt_probes'] else None,
+      'check_tests': done['check_tests'],
+      'pvs_researches': done['pvs_researches'],
+      'aspiration_researches': done['aspiration_researches'],
+      'null_moves': done['null_moves'],
+      'null_move_cutoffs': done['null_move_cutoffs'],
+      'lmr_reductions': done['lmr_reductions'],
+      'lmr_researches': done['lmr_researches'],
+      'futility_prunes': done['futility_prunes'],
+      'razor_prunes': done['razor_prunes'],
+      'mate_distance_prunes': done['mate_distance_prunes'],
+      'pv': [move.notation() for move in self.pv_table.get(0, [])],
+      'branching_factor': branching_factor,
+    }
     
   """
   Minimax algorithm with Alpha-Beta Pruning.
 
   White is the maximizer.
   Black is the minimizer. 
+
+  The search plays and takes back moves on the single board it is given,
+  so board is left exactly as it was found. Returns the score together
+  with the best move, not the position it leads to.
+
+  Results are kept in the transposition table. An entry searched at least
+  as deep as we are about to search may end the node straight away.
+  Otherwise, moves are generated lazily, starting with the best move the
+  table remembers (or, down the line of the last iteration, the move of
+  that line), and in the order MoveOrderer puts them in.
+
+  Principal variation search: once the first move has set a bound, the
+  other moves are only searched with a null window, to prove they are no
+  better. One that turns out better after all is searched again with the
+  full window. Every move that raises the bound also puts its line into
+  the PV table.
+
+  Selective search. Away from the root and the line of the last iteration,
+  and when not in check:
+  - Null-move pruning: if the side to move could pass and still not fall
+    below the bound in a shallower search, a real move will not either.
+  - Late move reductions: late quiet moves that do not give check are
+    searched a ply less deep first (see LMR_MIN_INDEX).
+  Each is switched by use_null_move and use_lmr. Searches past a null move
+  take depth_limit down by the reduction, and allow_null off. Close to the
+  horizon, futility pruning and razoring (see FRONTIER_DEPTH) take over.
+
+  A side left without a move is mated if in check, and stalemated, which
+  scores 0, if not. Mate distance pruning narrows the
+  window to the scores still possible this far from the root: no better
+  than mating on the next ply, no worse than being mated on this one. Once
+  a mate has been found, that cuts off every line longer than it.
   """
   def get_best_position(self, board: Chessboard, color,
-    depth: int, depth_limit: int, alpha: float=float("-inf"), beta: float=float("+inf")):
+    depth: int, depth_limit: int, alpha: float=float("-inf"), beta: float=float("+inf"),
+    allow_null: bool=True):
+
+    self.pv_table[depth] = []
 
     if depth == depth_limit:
-      return board.evaluate(), None
+      return self.quiescence(board, color, alpha, beta, 0), None
 
     else:
 
+      self.nodes += 1
+      self.countdown -= 1
+      if not self.countdown:
+        self.poll()
+      if self.stopped:
+        return 0, None
+
+      remaining = depth_limit - depth
+
+      if self.use_mate_distance and depth > 0:
+        if color == "w":
+          alpha = max(alpha, -(MATE - depth))
+          beta = min(beta, MATE - depth - 1)
+        else:
+          alpha = max(alpha, -(MATE - depth - 1))
+          beta = min(beta, MATE - depth)
+
+        if alpha >= beta:
+          self.mate_distance_prunes += 1
+          return (alpha if color == "w" else beta), None
+
+      tt_move = None
+      entry = self.tt.probe(board.hash)
+
+      if entry is not None:
+        tt_depth, tt_score, tt_bound, tt_move = entry
+        tt_score = score_from_tt(tt_score, depth)
+
+        # Never cut the root short: the caller needs a move out of it
+        if depth > 0 and tt_depth >= remaining:
+          if (tt_bound == EXACT
+            or (tt_bound == LOWER and tt_score >= beta)
+            or (tt_bound == UPPER and tt_score <= alpha)):
+            if tt_move is not None:
+              self.pv_table[depth] = [tt_move]
+            return tt_score, tt_move
+
+      if self.follow_pv:
+        if depth < len(self.previous_pv):
+          tt_move = self.previous_pv[depth]
+        else:
+          self.follow_pv = False
+
+      other = OTHER_COLOR[color]
+      calm = (depth > 0 and not self.follow_pv
+        and (self.use_null_move or self.use_lmr or self.use_futility or self.use_razoring)
+        and not board.is_attacked(board.king_squares[color], other))
+      selective = calm and remaining >= LMR_MIN_DEPTH
+
+      futile = False
+      if calm and remaining <= FRONTIER_DEPTH:
+        static = board.evaluate()
+
+        if color == "w":
+          if self.use_razoring and static + RAZOR_MARGINS[remaining] <= alpha:
+            score = self.quiescence(board, color, alpha, alpha + 1, 0)
+            if self.stopped:
+              return 0, None
+            if score <= alpha:
+              self.razor_prunes += 1
+              return alpha, None
+          futile = self.use_futility and static + FUTILITY_MARGINS[remaining] <= alpha
+
+        else:
+          if self.use_razoring and static - RAZOR_MARGINS[remaining] >= beta:
+            score = self.quiescence(board, color, beta - 1, beta, 0)
+            if self.stopped:
+              return 0, None
+            if score >= beta:
+              self.razor_prunes += 1
+              return beta, None
+          futile = self.use_futility and static - FUTILITY_MARGINS[remaining] >= beta
+
+      if (selective and allow_null and self.use_null_move
+        and not is_mate(beta if color == "w" else alpha)
+        and any(board.inventory[color][piece_type] for piece_type in NULL_MOVE_PIECES)):
+        reduction = NULL_MOVE_R + 1 if remaining > NULL_MOVE_DEEP else NULL_MOVE_R
+        self.null_moves += 1
+
+        last_move = board.make_null_move()
+        if color == "w":
+          score, _ = self.get_best_position(board, other, depth + 1,
+            depth_limit - reduction, beta - 1, beta, False)
+        else:
+          score, _ = self.get_best_position(board, other, depth + 1,
+            depth_limit - reduction, alpha, alpha + 1, False)
+        board.unmake_null_move(last_move)
+
+        if self.stopped:
+          return 0, None
+
+        if color == "w" and score >= beta:
+          self.null_move_cutoffs += 1
+          return beta, None
+        if color == "b" and score <= alpha:
+          self.null_move_cutoffs += 1
+          return alpha, None
+
+      reducible = selective and self.use_lmr
+      moves = board.legal_moves(color, tt_move, self.ordering, depth)
+
       if color == "w":
-        best_position = None
-        for candidate in board.legal_positions(color):
-          score, _ = self.get_best_position(candidate, "b",
-            depth + 1, depth_limit, alpha, beta)
+        best_move = None
+        index = -1
+        for index, move in enumerate(moves):
+          proven = None
+          quiet = board.empty_in(move.to_coord)
+          undo = board.make_move(move)
+
+          checks = (quiet and (futile or (reducible and index >= LMR_MIN_INDEX))
+            and board.is_attacked(board.king_squares["b"], color))
+
+          if futile and quiet and not checks:
+            board.unmake_move(undo)
+            self.futility_prunes += 1
+            continue
+
+          limit = depth_limit
+          if reducible and index >= LMR_MIN_INDEX and quiet and not checks:
+            limit -= 1
+            self.lmr_reductions += 1
+
+          if index == 0 or alpha == float('-inf') or (limit == depth_limit and not self.use_pvs):
+            score, _ = self.get_best_position(board, "b",
+              depth + 1, depth_limit, alpha, beta)
+          else:
+            window = (alpha, alpha + 1) if self.use_pvs else (alpha, beta)
+            score, _ = self.get_best_position(board, "b",
+              depth + 1, limit, *window)
+            if limit < depth_limit and score > alpha and not self.stopped:
+              self.lmr_researches += 1
+              score, _ = self.get_best_position(board, "b",
+                depth + 1, depth_limit, *window)
+            if self.use_pvs and alpha < score < beta and not self.stopped:
+              # Having failed high, the move is already known to beat best_move
+              proven = move
+              self.pvs_researches += 1
+              score, _ = self.get_best_position(board, "b",
+                depth + 1, depth_limit, alpha, beta)
+          board.unmake_move(undo)
+
+          # Only the first move can be on the line of the last iteration
+          self.follow_pv = False
+
+          if self.stopped:
+            # The root hands out a proven move even if its re-search was cut short
+            return (alpha, proven if depth == 0 and proven is not None else best_move)
           
           # Move that Black would take in response to this move has higher
           # score than the previous score assured for White.
           if score > alpha:
             alpha = score
-            best_position = candidate
+            best_move = move
+            self.pv_table[depth] = [move] + self.pv_table.get(depth + 1, [])
 
             # Alpha-Beta cutoff. The maximum score assured to Black is
             # less than the minimum score assured to White. Black will
             # never allow white to reach this position.
             if alpha >= beta:
+              self.ordering.record_cutoff(board, move, depth, remaining, index)
               break
+
+        if index < 0:
+          # No move at all: White is mated, or stalemated when not in check
+          score = -(MATE - depth) if board.is_attacked(board.king_squares["w"], other) else 0
+          self.tt.store(board.hash, remaining, score_to_tt(score, depth), EXACT)
+          return score, None
+
+        if alpha >= beta:
+          bound = LOWER
+        elif best_move is None:
+          bound = UPPER
+        else:
+          bound = EXACT
+        self.tt.store(board.hash, remaining, score_to_tt(alpha, depth), bound, best_move)
         
-        return (alpha, best_position)
+        return (alpha, best_move)
 
       else: # color: 'b'
-        best_position = None
-        for candidate in board.legal_positions(color):
-          score, _ = self.get_best_position(candidate, "w",
-            depth + 1, depth_limit, alpha, beta)
+        best_move = None
+        index = -1
+        for index, move in enumerate(moves):
+          proven = None
+          quiet = board.empty_in(move.to_coord)
+          undo = board.make_move(move)
+
+          checks = (quiet and (futile or (reducible and index >= LMR_MIN_INDEX))
+            and board.is_attacked(board.king_squares["w"], color))
+
+          if futile and quiet and not checks:
+            board.unmake_move(undo)
+            self.futility_prunes += 1
+            continue
+
+          limit = depth_limit
+          if reducible and index >= LMR_MIN_INDEX and quiet and not checks:
+            limit -= 1
+            self.lmr_reductions += 1
+
+          if index == 0 or beta == float('+inf') or (limit == depth_limit and not self.use_pvs):
+            score, _ = self.get_best_position(board, "w",
+              depth + 1, depth_limit, alpha, beta)
+          else:
+            window = (beta - 1, beta) if self.use_pvs else (alpha, beta)
+            score, _ = self.get_best_position(board, "w",
+              depth + 1, limit, *window)
+            if limit < depth_limit and score < beta and not self.stopped:
+              self.lmr_researches += 1
+              score, _ = self.get_best_position(board, "w",
+                depth + 1, depth_limit, *window)
+            if self.use_pvs and alpha < score < beta and not self.stopped:
+              # Having failed high, the move is already known to beat best_move
+              proven = move
+              self.pvs_researches += 1
+              score, _ = self.get_best_position(board, "w",
+                depth + 1, depth_limit, alpha, beta)
+          board.unmake_move(undo)
+
+          # Only the first move can be on the line of the last iteration
+          self.follow_pv = False
+
+          if self.stopped:
+            # The root hands out a proven move even if its re-search was cut short
+            return (beta, proven if depth == 0 and proven is not None else best_move)
 
           # Move that White would take in response to this move has lower
           # score than the previous score assured for Black.
           if score < beta:
             beta = score
-            best_position = candidate
+            best_move = move
+            self.pv_table[depth] = [move] + self.pv_table.get(depth + 1, [])
 
             # Alpha-Beta cutoff. The minimum score assured to White is
             # more than the maximum score assured to Black.
             if alpha >= beta:
+              self.ordering.record_cutoff(board, move, depth, remaining, index)
               break
 
-        return (beta, best_position)
+        if index < 0:
+          # No move at all: Black is mated, or stalemated when not in check
+          score = MATE - depth if board.is_attacked(board.king_squares["b"], other) else 0
+          self.tt.store(board.hash, remaining, score_to_tt(score, depth), EXACT)
+          return score, None
+
+        if alpha >= beta:
+          bound = UPPER
+        elif best_move is None:
+          bound = LOWER
+        else:
+          bound = EXACT
+        self.tt.store(board.hash, remaining, score_to_tt(beta, depth), bound, best_move)
+
+        return (beta, best_move)
+
+  """
+  Quiescence search. Past the depth limit, keep searching captures only,
+  so that the score is never taken in the middle of an exchange.
+
+  The side to move may always 'stand pat' on the static evaluation instead
+  of capturing. Captures that could not raise the score to the bound even
+  with DELTA_MARGIN to spare are skipped (delta pruning), and the search
+  stops max_qdepth captures past the depth limit.
+  """
+  def quiescence(self, board: Chessboard, color, alpha: float, beta: float, qdepth: int):
+    self.qnodes += 1
+    self.countdown -= 1
+    if not self.countdown:
+      self.poll()
+    if self.stopped:
+      return 0
+
+    stand_pat = board.evaluate()
+
+    if qdepth == self.max_qdepth:
+      return stand_pat
+
+    if color == "w":
+      if stand_pat >= beta:
+        return beta
+      alpha = max(alpha, stand_pat)
+
+      for move in board.legal_moves(color, ordering=self.ordering, quiets=False):
+        gain = PIECE_VALUE[type(board.piece_in(move.to_coord))]
+        if stand_pat + gain + DELTA_MARGIN <= alpha:
+          continue
+
+        undo = board.make_move(move)
+        score = self.quiescence(board, "b", alpha, beta, qdepth + 1)
+        board.unmake_move(undo)
+
+        if score > alpha:
+          alpha = score
+          if alpha >= beta:
+            break
+
+      return alpha
+
+    else: # color: 'b'
+      if stand_pat <= alpha:
+        return alpha
+      beta = min(beta, stand_pat)
+
+      for move in board.legal_moves(color, ordering=self.ordering, quiets=False):
+        gain = PIECE_VALUE[type(board.piece_in(move.to_coord))]
+        if stand_pat - gain - DELTA_MARGIN >= beta:
+          continue
+
+        undo = board.make_move(move)
+        score = self.quiescence(board, "w", alpha, beta, qdepth + 1)
+        board.unmake_move(undo)
+
+        if score < beta:
+          beta = score
+          if alpha >= beta:
+            break
+
+      return beta
+
+# The AI and shared state of a root-split search worker process, set up
+# by init_root_worker when the pool starts the process.
+_root_worker = {}
+
+def init_root_worker(bound, stop, tt_size_mb: float, backend: str):
+  _root_worker['ai'] = AI('w', tt_size_mb)
+  _root_worker['bound'] = bound
+  _root_worker['stop'] = stop
+  _root_worker['backend'] = backend
+  _root_worker['fen'] = None
+
+"""
+Searches the root move code of position fen, to depth_limit counted from
+the root, in a root-split search worker. The best score found so far for
+the side to move at the root is read from the shared bound and used as the
+window, and updated when this move does better.
+
+Returns (code, score, exact, nodes, pv, stopped). A move that does no
+better than the bound it was searched with comes back with exact False:
+its score is then only a bound, and it cannot be the best move.
+"""
+def search_root_move(fen: str, code: int, depth_limit: int, deadline: float=None):
+  ai = _root_worker['ai']
+  bound = _root_worker['bound']
+
+  board = BACKENDS[_root_worker['backend']].from_fen(fen)
+  color = board.turn
+  if fen != _root_worker['fen']:
+    _root_worker['fen'] = fen
+    ai.tt.new_search()
+    ai.ordering.new_search()
+
+  ai.start_search(_root_worker['stop'], deadline)
+
+  move = Move.decode(code)
+  window = bound.value
+  board.make_move(move)
+
+  if color == 'w':
+    score, _ = ai.get_best_position(board, 'b', 1, depth_limit, window, float('+inf'))
+    exact = score > window
+  else:
+    score, _ = ai.get_best_position(board, 'w', 1, depth_limit, float('-inf'), window)
+    exact = score < window
+
+  pv = [code] + [reply.encode() for reply in ai.pv_table.get(1, [])]
+
+  if exact and not ai.stopped:
+    with bound.get_lock():
+      if (score > bound.value) if color == 'w' else (score < bound.value):
+        bound.value = score
+
+  return code, score, exact, ai.nodes + ai.qnodes, pv, ai.stopped
+
+"""
+Parallel search that splits the moves of the root across a process pool.
+The first move, the best one of the previous iteration, is searched on its
+own to set a bound; the rest are then searched all at once, sharing the
+best score found so far through shared memory, and the results are
+reduced here.
+
+Speaks the same get_best_position_ID protocol as AI, so the engine worker
+can use either. The pool's processes look at the stop event given here,
+which should be the one passed to get_best_position_ID. The pool, and with
+it every process's transposition table, lives until close().
+"""
+class RootSplitSearch:
+  def __init__(self, workers: int, tt_size_mb: float=DEFAULT_SIZE_MB, backend: str='array',
+    stop=None):
+    self.workers = workers
+    self.bound = mp.Value('d', 0.0)
+    self.stop = stop if stop is not None else mp.Event()
+    self.pool = ProcessPoolExecutor(workers, initializer=init_root_worker,
+      initargs=(self.bound, self.stop, tt_size_mb, backend))
+    self.nodes = 0
+
+  def close(self):
+    self.pool.shutdown()
+
+  """
+  Searches every root move of board to depth_limit. Returns
+  (score, best_move code, pv, stopped), best_move being None when there is
+  no move or the search was stopped before any move was searched through.
+  """
+  def search(self, board: Chessboard, codes: list, depth_limit: int, deadline: float=None):
+    color = board.turn
+    fen = board.to_fen()
+    self.bound.value = float('-inf') if color == 'w' else float('+inf')
+
+    results = [self.pool.submit(search_root_move, fen, codes[0], depth_limit, deadline).result()]
+    futures = [self.pool.submit(search_root_move, fen, code, depth_limit, deadline)
+      for code in codes[1:]]
+    results += [future.result() for future in futures]
+
+    # Without the previous best move to compare with, nothing is confirmed
+    if results[0][5]:
+      return None, None, [], True
+
+    best = None
+    stopped = False
+    for code, score, exact, nodes, pv, move_stopped in results:
+      self.nodes += nodes
+      stopped = stopped or move_stopped
+
+      if move_stopped or not exact:
+        continue
+
+      if (best is None
+        or (score > best[0] if color == 'w' else score < best[0])):
+        best = (score, code, pv)
+
+    if best is None:
+      return None, None, [], stopped
+
+    return best + (stopped,)
+
+  def get_best_position_ID(self, board: Chessboard, color, return_queue: mp.Queue,
+    stop=None, deadline: float=None, max_depth: int=None):
+
+    self.nodes = 0
+    codes = [move.encode() for move in board.legal_moves(color)]
+    depth_limit = 0
+
+    while codes and (max_depth is None or depth_limit < max_depth):
+      depth_limit += 1
+      print(f"Depth limit = {depth_limit}", file=sys.stderr)
+      score, code, pv, stopped = self.search(board, codes, depth_limit, deadline)
+
+      if stopped or (stop is not None and stop.is_set()):
+        # As with AI, a move that beat the previous best one still counts
+        if code is not None:
+          return_queue.put(SearchResult(code, score, depth_limit - 1, self.nodes, pv))
+        break
+
+      return_queue.put(SearchResult(code, score, depth_limit, self.nodes, pv))
+
+      if is_mate(score):
+        break
+
+      # Search the best move first in the next iteration
+      codes.remove(code)
+      codes.insert(0, code)
+
+    if not codes:
+      mated = board.is_attacked(board.king_squares[color], OTHER_COLOR[color])
+      score = (-MATE if color == 'w' else MATE) if mated else 0
+      return_queue.put(SearchResult(None, score, 0, 0, []))
+
+    return_queue.put(None)
+
+"""
+Body of a Lazy SMP helper process. On ('search', fen) it deepens on the
+position until stop is set, starting offset plies deeper than the main
+search does, and replies ('done', nodes). All it leaves behind is what
+it stored in the shared transposition table.
+"""
+def serve_helper(conn, tt: SharedTranspositionTable, backend: str, stop, offset: int):
+  ai = AI('w', tt=tt)
+
+  while True:
+    command, *args = conn.recv()
+
+    if command == 'search':
+      board = BACKENDS[backend].from_fen(args[0])
+      ai.ordering.new_search()
+      ai.start_search(stop)
+      depth_limit = offset
+
+      while not ai.stopped:
+        depth_limit += 1
+        score, best_move = ai.get_best_position(board, board.turn, 0, depth_limit)
+        if best_move is None or is_mate(score):
+          stop.wait()
+          break
+
+      conn.send(('done', ai.nodes + ai.qnodes))
+
+    elif command == 'quit':
+      conn.close()
+      return
+
+"""
+Lazy SMP. The main search runs here as a plain AI, while workers - 1
+helper processes search the same position at the same time, every other
+one a ply deeper. They share nothing but a SharedTranspositionTable, so
+each helper fills in entries the main search would otherwise have to
+search for itself, and only the FEN of the position is sent to them.
+
+Speaks the same get_best_position_ID protocol as AI; results come from the
+main search alone. The helpers live until close().
+"""
+class LazySMPSearch:
+  def __init__(self, workers: int, tt_size_mb: float=DEFAULT_SIZE_MB, backend: str='array'):
+    self.workers = workers
+    self.tt = SharedTranspositionTable(tt_size_mb)
+    self.ai = AI('w', tt=self.tt)
+    self.helper_stop = mp.Event()
+    self.helper_nodes = 0
+    self.helpers = []
+
+    for helper in range(1, workers):
+      conn, helper_conn = mp.Pipe()
+      process = mp.Process(target=serve_helper,
+        args=(helper_conn, self.tt, backend, self.helper_stop, helper % 2), daemon=True)
+      process.start()
+      self.helpers.append((conn, process))
+
+  @property
+  def nodes(self):
+    return self.ai.nodes + self.ai.qnodes + self.helper_nodes
+
+  def close(self):
+    for conn, process in self.helpers:
+      conn.send(('quit',))
+      process.join()
+    self.tt.close()
+
+  def get_best_position_ID(self, board: Chessboard, color, return_queue: mp.Queue,
+    stop=None, deadline: float=None, max_depth: int=None):
+
+    fen = board.to_fen()
+    self.helper_stop.clear()
+    for conn, _ in self.helpers:
+      conn.send(('search', fen))
+
+    try:
+      self.ai.get_best_position_ID(board, color, return_queue, stop, deadline, max_depth)
+    finally:
+      self.helper_stop.set()
+      self.helper_nodes = sum(conn.recv()[1] for conn, _ in self.helpers)
+
+"""
+Body of the engine worker process. Owns an AI and its own copy of the
+board, and takes commands from conn for as long as the game lasts, so the
+transposition table, move ordering tables and the board caches all stay
+warm from one move to the next.
+
+Commands are tuples, and only moves (as Move.encode() codes) and FEN
+strings travel over conn:
+- ('position', fen): set up the board.
+- ('move', code): play a move on the board, whoever played it.
+- ('go', seconds): search for the side to move, for at most that long.
+  Replies with ('result', SearchResult of the last iteration), or
+  ('result', None) when not even one iteration finished.
+- ('quit',)
+"""
+def serve_engine(conn, color: str, tt_size_mb: float, backend: str, stop, workers: int=1,
+  parallel: str='root_split'):
+  if workers > 1 and parallel == 'lazy_smp':
+    ai = LazySMPSearch(workers, tt_size_mb, backend)
+  elif workers > 1:
+    ai = RootSplitSearch(workers, tt_size_mb, backend, stop)
+  else:
+    ai = AI(color, tt_size_mb)
+  board = BACKENDS[backend]()
+
+  while True:
+    command, *args = conn.recv()
+
+    if command == 'position':
+      board = BACKENDS[backend].from_fen(args[0])
+
+    elif command == 'move':
+      board.make_move(Move.decode(args[0]))
+
+    elif command == 'go':
+      stop.clear()
+      results = queue.SimpleQueue()
+      ai.get_best_position_ID(board, board.turn, results, stop,
+        time.monotonic() + args[0])
+
+      last = None
+      while True:
+        result = results.get()
+        if result is None:
+          break
+        last = result
+
+      conn.send(('result', last))
+
+    elif command == 'quit':
+      if workers > 1:
+        ai.close()
+      conn.close()
+      return
+
+"""
+The game's end of the engine worker process, see serve_engine.
+"""
+class EngineWorker:
+  def __init__(self, color: str, tt_size_mb: float=DEFAULT_SIZE_MB, backend: str='array',
+    workers: int=1, parallel: str='root_split'):
+    self.color = color
+    self.stop = mp.Event()
+    self.conn, worker_conn = mp.Pipe()
+
+    # A daemon process may not start a pool of its own
+    self.process = mp.Process(target=serve_engine,
+      args=(worker_conn, color, tt_size_mb, backend, self.stop, workers, parallel),
+      daemon=workers == 1)
+    self.process.start()
+
+  def position(self, board: Chessboard):
+    self.conn.send(('position', board.to_fen()))
+
+  def move(self, move: Move):
+    self.conn.send(('move', move.encode()))
+
+  """
+  Searches the position for at most seconds. Returns the SearchResult of
+  the deepest iteration, or None.
+  """
+  def go(self, seconds: float):
+    self.conn.send(('go', seconds))
+    _, result = self.conn.recv()
+
+    return result
+
+  def close(self):
+    self.conn.send(('quit',))
+    self.process.join()
 
 class Game:
-  def __init__(self):
-    self.board = Chessboard()
+  def __init__(self, backend: str='array'):
+    self.backend = backend
+    self.board = BACKENDS[backend]()
     self.time_limit = 1
+    self.tt_size_mb = DEFAULT_SIZE_MB
+    # Processes searching in parallel, and how: 'root_split' (see
+    # RootSplitSearch) or 'lazy_smp' (see LazySMPSearch)
+    self.workers = 1
+    self.parallel = 'root_split'
     self.human_color = None
-    self.AI = None
+    self.engine = None
 
   def config(self):
     print("Prince's Chess (named after my dog!)")
@@ -102,7 +1090,9 @@ class Game:
         # A limitation of this program as it stands is that the human
         # player MUST play white.
         self.human_color = 'w'
-        self.AI = AI('b')
+        self.engine = EngineWorker('b', self.tt_size_mb, self.backend,
+          self.workers, self.parallel)
+        self.engine.position(self.board)
         break
 
       except KeyboardInterrupt:
@@ -113,7 +1103,11 @@ class Game:
         print("You inputted a really, really weird value")
         continue
 
-    self.start()
+    try:
+      self.start()
+    finally:
+      if self.engine is not None:
+        self.engine.close()
         
   def start(self):
     print("### Game START ###")
@@ -153,16 +1147,20 @@ class Game:
         continue
 
       move = Move(from_coord, to_coord)
-      new_position = self.board.make_move(move)
+      undo = self.board.make_move(move)
 
-      if new_position.is_check(self.human_color):
+      if self.board.is_check(self.human_color):
+        self.board.unmake_move(undo)
         print("That was an illegal move.")
         continue
-      
-      self.board = new_position
 
-      if self.board.is_checkmate(self.AI.color):
-        print(f"{LONGFORM_COLOR[self.human_color]} Wins! You win!")
+      self.engine.move(move)
+
+      if self.board.is_checkmate(self.engine.color):
+        if self.board.is_check(self.engine.color):
+          print(f"{LONGFORM_COLOR[self.human_color]} Wins! You win!")
+        else:
+          print("Stalemate! It's a draw.")
         return
 
       self.board.print_board(vertical_flip=vertical_flip)
@@ -172,31 +1170,36 @@ class Game:
       #
       print("CPU is thinking...")
 
-      return_queue = mp.Queue()
-      ID_worker = mp.Process(target=self.AI.get_best_position_ID,
-        args=(self.board, self.AI.color, return_queue))
-      ID_worker.start()
-
       start = time.perf_counter()
 
-      time.sleep(self.time_limit)
-      ID_worker.terminate()
+      # The engine stops by itself by the deadline, or earlier when it is done
+      result = self.engine.go(self.time_limit)
 
       end = time.perf_counter()
 
-      depth_achieved = 0
-      while not return_queue.empty():
-        depth_achieved += 1
-        score, best_position = return_queue.get()
-      
-      print(f"Achieved depth {depth_achieved} in {end - start:.1f} seconds with Iterative Deepening")
-      print(f"Score: {score}")
+      # The AI has a move, or the game would have ended above. Without a
+      # single finished iteration to pick it, play the first legal one.
+      if result is None or result.move is None:
+        print(f"No search finished in {end - start:.1f} seconds, playing the first legal move")
+        best_move = next(self.board.legal_moves(self.engine.color))
+
+      else:
+        print(f"Achieved depth {result.depth} in {end - start:.1f} seconds with Iterative Deepening")
+        print(f"Score: {result.score}")
+        print("Line: " + " ".join(Move.decode(code).notation() for code in result.pv))
+
+        best_move = Move.decode(result.move)
 
-      self.board = best_position
+      self.board.make_move(best_move)
+      self.engine.move(best_move)
 
-      if self.board is None or self.board.is_checkmate(self.human_color):
-        print(f"{LONGFORM_COLOR[self.AI.color]} Wins! AI wins!")
+      if self.board.is_checkmate(self.human_color):
+        if self.board.is_check(self.human_color):
+          print(f"{LONGFORM_COLOR[self.engine.color]} Wins! AI wins!")
+        else:
+          print("Stalemate! It's a draw.")
         return
 
-g = Game()
-g.config()
+if __name__ == '__main__':
+  g = Game()
+  g.config()
@@ -0,0 +1,187 @@
+from bitboard import BACKENDS
+from chessboard import OTHER_COLOR
+from coord import Coord
+from perft import PERFT_SUITE
+from pieces import *
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+# Every primitive is timed this many times over the whole corpus, and the
+# fastest run is kept: slower runs only measure interference.
+REPEATS = 5
+
+# Each timed run loops over the corpus until it takes at least this long,
+# so that timer resolution doesn't show up in the results
+MIN_RUN_SECONDS = 0.05
+
+# Slowdown, as a fraction, past which compare flags a primitive
+DEFAULT_THRESHOLD = 0.10
+
+DEFAULT_BASELINE = 'microbench_baseline.json'
+
+CORPUS = [position['fen'] for position in PERFT_SUITE]
+
+"""
+Each primitive gets the corpus boards and returns a function that runs the
+primitive over all of them, along with how many operations one call of it
+makes. Setup, like finding the moves to play, happens outside the timing.
+"""
+def bench_coord(boards):
+  def run():
+    for y in range(8):
+      for x in range(8):
+        Coord(y, x)
+  return run, 64
+
+def bench_hash(boards):
+  def run():
+    for board in boards:
+      hash(board)
+  return run, len(boards)
+
+def bench_make_move(boards):
+  work = [(board, list(board.legal_moves(board.turn))) for board in boards]
+
+  def run():
+    for board, moves in work:
+      for move in moves:
+        board.unmake_move(board.make_move(move))
+  return run, sum(len(moves) for _, moves in work)
+
+# The ray-based attack test behind is_check, timed directly: is_check
+# itself answers from the safe_positions cache after the first loop
+def bench_is_attacked(boards):
+  work = [(board, board.king_squares[board.turn], OTHER_COLOR[board.turn]) for board in boards]
+
+  def run():
+    for board, sq, by_color in work:
+      board.is_attacked(sq, by_color)
+  return run, len(work)
+
+def bench_evaluate(boards):
+  def run():
+    for board in boards:
+      board.evaluate()
+  return run, len(boards)
+
+def bench_legal_positions(boards):
+  def run():
+    for board in boards:
+      board.legal_positions(board.turn)
+  return run, len(boards)
+
+def bench_valid_moves(piece_type):
+  def bench(boards):
+    work = [
+      (board, board.piece_at(sq), Coord(sq >> 3, sq & 7))
+      for board in boards
+      for sq in range(64)
+      if type(board.piece_at(sq)) is piece_type
+    ]
+
+    def run():
+      for board, piece, coord in work:
+        for _ in piece.valid_moves(board, coord):
+          pass
+    return run, len(work)
+  return bench
+
+PRIMITIVES = {
+  'Coord': bench_coord,
+  'Chessboard.__hash__': bench_hash,
+  'Chessboard.make_move': bench_make_move,
+  'Chessboard.is_attacked': bench_is_attacked,
+  'Chessboard.evaluate': bench_evaluate,
+  'Chessboard.legal_positions': bench_legal_positions,
+  **{
+    f"{piece_type.__name__}.valid_moves": bench_valid_moves(piece_type)
+    for piece_type in (Pawn, Knight, Bishop, Rook, Queen, King)
+  },
+}
+
+def time_loops(run, loops: int):
+  start = time.perf_counter()
+  for _ in range(loops):
+    run()
+  return time.perf_counter() - start
+
+"""
+Times every primitive over the corpus. Returns nanoseconds per operation
+by primitive name, with the details of the run.
+"""
+def run_benchmarks(backend: str='array'):
+  results = {}
+
+  for name, bench in PRIMITIVES.items():
+    boards = [BACKENDS[backend].from_fen(fen) for fen in CORPUS]
+    run, ops = bench(boards)
+
+    loops = 1
+    while time_loops(run, loops) < MIN_RUN_SECONDS:
+      loops *= 2
+
+    best = min(time_loops(run, loops) for _ in range(REPEATS))
+
+    results[name] = {
+      'ns_per_op': round(best / (loops * ops) * 1e9, 1),
+      'ops': loops * ops,
+    }
+
+  return {
+    'backend': backend,
+    'python': platform.python_version(),
+    'primitives': results,
+  }
+
+"""
+Primitives that got slower than baseline by more than threshold (a
+fraction), as {name: (baseline ns, current ns, slowdown)}.
+"""
+def compare(baseline: dict, current: dict, threshold: float=DEFAULT_THRESHOLD):
+  regressions = {}
+
+  for name, result in current['primitives'].items():
+    if name not in baseline['primitives']:
+      continue
+
+    before = baseline['primitives'][name]['ns_per_op']
+    after = result['ns_per_op']
+    slowdown = after / before - 1 if before else 0.0
+
+    if slowdown > threshold:
+      regressions[name] = (before, after, round(slowdown, 3))
+
+  return regressions
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Micro-benchmarks of the engine's hot primitives.")
+  parser.add_argument('--backend', choices=sorted(BACKENDS), default='array')
+  parser.add_argument('--save', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+    help="store the results as the baseline")
+  parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+    help="flag primitives slower than the baseline")
+  parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+    help="slowdown (as a fraction) that counts as a regression")
+  args = parser.parse_args()
+
+  report = run_benchmarks(args.backend)
+  print(json.dumps(report, indent=2))
+
+  if args.save:
+    with open(args.save, 'w') as f:
+      json.dump(report, f, indent=2)
+
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+
+    regressions = compare(baseline, report, args.threshold)
+    for name, (before, after, slowdown) in regressions.items():
+      print(f"{name}: {before} -> {after} ns/op ({slowdown:+.1%})")
+
+    if regressions:
+      sys.exit(1)
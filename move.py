@@ -1,17 +1,46 @@
-from coord import Coord
+from coord import Coord, COORDS
 
 class Move:
+  __slots__ = ('from_coord', 'to_coord')
+
+  # The instances in MOVES are handed out to every caller, so moves are
+  # immutable like coordinates are
   def __init__(self, from_coord: Coord, to_coord):
-    self.from_coord = from_coord
-    self.to_coord = to_coord
+    object.__setattr__(self, 'from_coord', from_coord)
+    object.__setattr__(self, 'to_coord', to_coord)
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Move is immutable")
+
+  def __reduce__(self):
+    return Move, (self.from_coord, self.to_coord)
 
   def __str__(self):
     return f"Move: {self.from_coord} -> {self.to_coord}"
 
+  def notation(self):
+    return self.from_coord.notation() + self.to_coord.notation()
+
   def __eq__(self, other: 'Move'):
     return self.from_coord == other.from_coord \
       and self.to_coord == other.to_coord
 
+  def __hash__(self):
+    return self.encode()
+
+  """
+  Packs the move into 12 bits: from square in the high 6, to square in the
+  low 6, squares numbered y * 8 + x. A move never starts and ends on the
+  same square, so 0 is free to mean 'no move'.
+  """
+  def encode(self):
+    return (self.from_coord.y * 8 + self.from_coord.x) << 6 \
+      | (self.to_coord.y * 8 + self.to_coord.x)
+
+  @staticmethod
+  def decode(code: int):
+    return MOVES[code]
+
   @staticmethod
   def is_valid(board: 'Chessboard', color: str, move: 'Move'):
     # Player tries to move an empty square
@@ -28,4 +57,6 @@ class Move:
 
     return True
 
-
+# Move generation hands out these shared instances, by Move.encode() code,
+# rather than build a new Move for every move it tries.
+MOVES = tuple(Move(COORDS[code >> 6], COORDS[code & 63]) for code in range(64 * 64))
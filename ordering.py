@@ -0,0 +1,109 @@
+from chessboard import PIECE_VALUE
+from pieces import *
+from move import Move
+
+# Quiet move ordering tiers, searched from the highest down
+KILLER = 1
+QUIET = 0
+
+KILLER_SLOTS = 2
+
+# PIECE_VALUE by kind of piece, as in the board's piece codes
+KIND_VALUE = [0] + [PIECE_VALUE[piece_type] for piece_type in PIECE_TYPES[PAWN:]]
+
+"""
+Decides in which order the search tries the moves of a node, so that the
+move most likely to cause a cutoff is searched first. Chessboard.legal_moves
+hands out the best move the transposition table remembers on its own, and
+asks this class to order the stages that follow:
+- Captures, most valuable victim first, least valuable attacker first
+  among those (MVV-LVA).
+- The two most recent quiet moves that caused a cutoff at the same ply
+  (killer moves).
+- The rest of the quiet moves, by how often they caused cutoffs anywhere
+  in the tree (history heuristic, per piece and target square).
+
+Also keeps track of how often the first move searched was the one that
+caused the cutoff, which is the measure of how good the ordering is.
+"""
+class MoveOrderer:
+  def __init__(self):
+    self.killers = []
+    self.history = {
+      sign * kind: [0] * 64
+      for kind in range(PAWN, KING + 1)
+      for sign in (1, -1)
+    }
+
+    self.cutoffs = 0
+    self.first_move_cutoffs = 0
+
+  """
+  Called at the start of every new search. Killers only make sense for the
+  position they were found in; history is halved rather than dropped, as
+  most of it still applies a move later.
+  """
+  def new_search(self):
+    self.killers = []
+    for scores in self.history.values():
+      for i in range(64):
+        scores[i] >>= 1
+
+  def killers_at(self, ply: int):
+    while len(self.killers) <= ply:
+      self.killers.append([None] * KILLER_SLOTS)
+
+    return self.killers[ply]
+
+  """
+  Captures, most valuable victim first and, among those, least valuable
+  attacker first.
+  """
+  def order_captures(self, board: 'Chessboard', captures):
+    squares = board.squares
+
+    def mvv_lva(move: Move):
+      attacker = squares[move.from_coord.y * 8 + move.from_coord.x]
+      victim = squares[move.to_coord.y * 8 + move.to_coord.x]
+      return 10 * KIND_VALUE[abs(victim)] - KIND_VALUE[abs(attacker)]
+
+    return sorted(captures, key=mvv_lva, reverse=True)
+
+  """
+  Quiet moves, the killers of the ply first and the rest by history score.
+  """
+  def order_quiets(self, board: 'Chessboard', quiets, ply: int):
+    killers = self.killers_at(ply)
+
+    def sort_key(move: Move):
+      for slot, killer in enumerate(killers):
+        if killer is not None and move == killer:
+          return (KILLER, KILLER_SLOTS - slot)
+
+      from_c, to_c = move.from_coord, move.to_coord
+      piece = board.squares[from_c.y * 8 + from_c.x]
+      return (QUIET, self.history[piece][to_c.y * 8 + to_c.x])
+
+    return sorted(quiets, key=sort_key, reverse=True)
+
+  """
+  Called with the move that caused a beta cutoff, before it is made, along
+  with its index in the ordered move list and the depth left to search.
+  """
+  def record_cutoff(self, board: 'Chessboard', move: Move, ply: int, depth: int, index: int):
+    self.cutoffs += 1
+    if index == 0:
+      self.first_move_cutoffs += 1
+
+    # Captures are already ordered well enough by MVV-LVA
+    if not board.empty_in(move.to_coord):
+      return
+
+    killers = self.killers_at(ply)
+    if killers[0] is None or not move == killers[0]:
+      killers[1:] = killers[:-1]
+      killers[0] = move
+
+    from_c, to_c = move.from_coord, move.to_coord
+    piece = board.squares[from_c.y * 8 + from_c.x]
+    self.history[piece][to_c.y * 8 + to_c.x] += depth * depth
@@ -0,0 +1,106 @@
+from bitboard import BACKENDS
+
+import argparse
+import json
+import sys
+import time
+
+"""
+Reference positions for perft, with the node counts this engine must find
+at every depth. The engine plays neither castling, en passant nor
+promotion, so past the start position's first 4 plies the counts differ
+from the published ones; these were cross-checked between both board
+backends and plain make-and-test move generation.
+"""
+PERFT_SUITE = [
+  {
+    'name': 'start',
+    'fen': 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1',
+    'nodes': {1: 20, 2: 400, 3: 8902, 4: 197281},
+  },
+  {
+    'name': 'kiwipete',
+    'fen': 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1',
+    'nodes': {1: 46, 2: 1865, 3: 86585},
+  },
+  {
+    'name': 'rook_endgame',
+    'fen': '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'nodes': {1: 14, 2: 191, 3: 2810, 4: 43087},
+  },
+  {
+    'name': 'open_middlegame',
+    'fen': 'r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP3PPP/R2QKB1R w - - 0 1',
+    'nodes': {1: 37, 2: 1257, 3: 46058},
+  },
+  {
+    'name': 'pinned_pieces',
+    'fen': '4k3/8/8/q2RK2r/8/8/4B3/4r3 w - - 0 1',
+    'nodes': {1: 6, 2: 224, 3: 3990, 4: 143644},
+  },
+  {
+    'name': 'check_evasions',
+    'fen': '4k3/8/8/8/1b6/8/3N4/r3K3 w - - 0 1',
+    'nodes': {1: 2, 2: 54, 3: 555, 4: 14157},
+  },
+  {
+    'name': 'double_check',
+    'fen': '4k3/8/8/8/1b6/8/5N2/r3K3 w - - 0 1',
+    'nodes': {1: 1, 2: 28, 3: 256, 4: 6649},
+  },
+]
+
+"""
+Runs perft on every suite position, at its deepest known depth or at depth
+if given. Returns one result per position, plus the totals.
+"""
+def run_suite(backend: str='array', depth: int=None):
+  results = []
+
+  for position in PERFT_SUITE:
+    position_depth = depth if depth is not None else max(position['nodes'])
+    board = BACKENDS[backend].from_fen(position['fen'])
+
+    start = time.perf_counter()
+    nodes = board.perft(position_depth)
+    seconds = time.perf_counter() - start
+
+    expected = position['nodes'].get(position_depth)
+    results.append({
+      'name': position['name'],
+      'fen': position['fen'],
+      'depth': position_depth,
+      'nodes': nodes,
+      'expected': expected,
+      'ok': expected is None or nodes == expected,
+      'seconds': round(seconds, 4),
+      'nps': round(nodes / seconds) if seconds else None,
+    })
+
+  nodes = sum(result['nodes'] for result in results)
+  seconds = sum(result['seconds'] for result in results)
+
+  return {
+    'backend': backend,
+    'positions': results,
+    'nodes': nodes,
+    'seconds': round(seconds, 4),
+    'nps': round(nodes / seconds) if seconds else None,
+    'ok': all(result['ok'] for result in results),
+  }
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="Perft node counts and move generation speed.")
+  parser.add_argument('--backend', choices=sorted(BACKENDS), default='array')
+  parser.add_argument('--depth', type=int, help="search every position to this depth")
+  parser.add_argument('--divide', metavar='FEN', help="print perft split by root move for FEN")
+  args = parser.parse_args()
+
+  if args.divide:
+    board = BACKENDS[args.backend].from_fen(args.divide)
+    print(json.dumps(board.divide(args.depth or 1), indent=2))
+  else:
+    report = run_suite(args.backend, args.depth)
+    print(json.dumps(report, indent=2))
+    if not report['ok']:
+      sys.exit(1)
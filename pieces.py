@@ -1,11 +1,16 @@
-from move import Move
-from coord import Coord
+from move import Move, MOVES
+from coord import Coord, COORDS
+from attacks import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, PAWN_FORWARD, RAYS, ORTHOGONAL, DIAGONAL
 
 class Empty:
+  __slots__ = ()
+
   def __str__(self):
     return u'\u25c7'
 
 class Piece:
+  __slots__ = ('color',)
+
   def __init__(self, color):
     self.color = color
 
@@ -21,7 +26,52 @@ class Piece:
 
     return self.color == other.color
 
+  # Leapers (Knight, King) may move to any of their target squares that is
+  # empty or holds an enemy.
+  def leaper_moves(self, board: 'Chessboard', from_c: 'Coord', targets,
+    captures: bool, quiets: bool):
+    moves = (from_c.y * 8 + from_c.x) << 6
+
+    for target in targets:
+      piece = board.piece_at(target)
+
+      # Nobody here
+      if type(piece) is Empty:
+        if quiets:
+          yield MOVES[moves | target]
+
+      # Enemy here
+      elif captures and piece.color != self.color:
+        yield MOVES[moves | target]
+
+  # Sliders (Bishop, Rook, Queen) move along each of their rays until they
+  # bump into a piece, which they may take if it is an enemy.
+  def slider_moves(self, board: 'Chessboard', from_c: 'Coord', directions,
+    captures: bool, quiets: bool):
+    from_sq = from_c.y * 8 + from_c.x
+    rays = RAYS[from_sq]
+    moves = from_sq << 6
+
+    for direction in directions:
+      for target in rays[direction]:
+        piece = board.piece_at(target)
+
+        # Nobody here
+        if type(piece) is Empty:
+          if quiets:
+            yield MOVES[moves | target]
+          continue
+
+        # Bump into enemy
+        if captures and piece.color != self.color:
+          yield MOVES[moves | target]
+
+        # Bump into anyone
+        break
+
 class Pawn(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2659'
     return u'\u265f'
@@ -29,208 +79,124 @@ class Pawn(Piece):
   # Valid move generation is used strictly to generate moves
   # for the AI player. The validity of moves inputted by the
   # human player is checked in Move.is_valid.
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    moves = []
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
 
-    if self.color == 'w':
+    forward = PAWN_FORWARD[self.color]
+    start_y = 6 if self.color == 'w' else 1
 
+    # A pawn on the last rank has nowhere left to go
+    t_y = from_c.y + forward
+    if not 0 <= t_y <= 7:
+      return
+
+    from_sq = from_c.y * 8 + from_c.x
+    moves = from_sq << 6
+    target = t_y * 8 + from_c.x
+
+    if quiets and board.empty_in(COORDS[target]):
       # Pawn is in starting position
-      if (from_c.y == 6 and board.empty_in(Coord(5, from_c.x))
-        and board.empty_in(Coord(4, from_c.x))):
-        moves.append(Move(from_c, Coord(4, from_c.x))) # Move forward 2 steps
-
-      if board.empty_in(Coord(from_c.y - 1, from_c.x)):
-        moves.append(Move(from_c, Coord(from_c.y - 1, from_c.x))) # Move forward 1 step
-
-      # Attacking north-west
-      t_y, t_x = from_c.y - 1, from_c.x - 1
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.is_enemy(board.piece_in(Coord(t_y, t_x)))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-      
-      # Attacking north-east
-      t_y, t_x = from_c.y - 1, from_c.x + 1
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.is_enemy(board.piece_in(Coord(t_y, t_x)))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-
-    else: # self.color == 'b'
-
-      if (from_c.y == 1 and board.empty_in(Coord(2, from_c.x))
-        and board.empty_in(Coord(3, from_c.x))):
-        moves.append(Move(from_c, Coord(3, from_c.x)))
-
-      if board.empty_in(Coord(from_c.y + 1, from_c.x)):
-        moves.append(Move(from_c, Coord(from_c.y + 1, from_c.x)))
-
-      # Attacking south-west
-      t_y, t_x = from_c.y + 1, from_c.x - 1
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.is_enemy(board.piece_in(Coord(t_y, t_x)))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-      
-      # Attacking south-east
-      t_y, t_x = from_c.y + 1, from_c.x + 1
-      if (Coord.is_in_bounds(t_y, t_x)
-        and self.is_enemy(board.piece_in(Coord(t_y, t_x)))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-
-    return moves 
+      if (from_c.y == start_y
+        and board.empty_in(COORDS[target + 8 * forward])):
+        yield MOVES[moves | target + 8 * forward] # Move forward 2 steps
+
+      yield MOVES[moves | target] # Move forward 1 step
+
+    if captures:
+      # Attacking west, then east
+      for target in PAWN_ATTACKS[self.color][from_sq]:
+        if self.is_enemy(board.piece_at(target)):
+          yield MOVES[moves | target]
 
 
 class Knight(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2658'
     return u'\u265e'
 
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    moves = []
-
-    # Enumerating possible moves clockwise, starting from North
-    possible_targets = (
-      (from_c.y - 2, from_c.x + 1),
-      (from_c.y - 1, from_c.x + 2),
-      (from_c.y + 1, from_c.x + 2),
-      (from_c.y + 2, from_c.x + 1),
-      (from_c.y + 2, from_c.x - 1),
-      (from_c.y + 1, from_c.x - 2),
-      (from_c.y - 1, from_c.x - 2),
-      (from_c.y - 2, from_c.x - 1),
-    )
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
 
-    for t_y, t_x in possible_targets:
-      if (Coord.is_in_bounds(t_y, t_x)
-        and (board.empty_in(Coord(t_y, t_x)) or board.piece_in(Coord(t_y, t_x)).is_enemy(self))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-
-    return moves
+    # Possible moves clockwise, starting from North
+    yield from self.leaper_moves(board, from_c,
+      KNIGHT_ATTACKS[from_c.y * 8 + from_c.x], captures, quiets)
 
 class Bishop(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2657'
     return u'\u265d'
 
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    moves = []
-
-    offsets = (
-      (-1, 1), # Move north-east
-      (1, 1), # Move south-east
-      (1, -1), # Move south-west
-      (-1, -1), # Move north-west
-    )
-
-    for offset in offsets:
-      t_y, t_x = from_c.y, from_c.x
-
-      while True:
-        t_y, t_x = t_y + offset[0], t_x + offset[1]
-        
-        # Exceeded bounds
-        if not Coord.is_in_bounds(t_y, t_x):
-          break
-        
-        t_c = Coord(t_y, t_x)
-        move = Move(from_c, t_c)
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
 
-        # Nobody here
-        if board.empty_in(t_c):
-          moves.append(move)
-          continue
-
-        # Bump into enemy
-        if board.piece_in(t_c).is_enemy(self):
-          moves.append(move)
-          break
-        
-        # Bump into friend
-        if board.piece_in(t_c).is_friend(self):
-          break
-
-    return moves
+    # Move north-east, south-east, south-west, then north-west
+    yield from self.slider_moves(board, from_c, DIAGONAL, captures, quiets)
 
 class Rook(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2656'
     return u'\u265c'
 
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    moves = []
-
-    offsets = (
-      (-1, 0), # Move north
-      (0, 1), # Move east
-      (1, 0), # Move south
-      (0, -1), # Move west
-    )
-
-    for offset in offsets:
-      t_y, t_x = from_c.y, from_c.x
-
-      while True:
-        t_y, t_x = t_y + offset[0], t_x + offset[1]
-        
-        # Exceeded bounds
-        if not Coord.is_in_bounds(t_y, t_x):
-          break
-        
-        t_c = Coord(t_y, t_x)
-        move = Move(from_c, t_c)
-
-        # Nobody here
-        if board.empty_in(t_c):
-          moves.append(move)
-          continue
-
-        # Bump into enemy
-        if board.piece_in(t_c).is_enemy(self):
-          moves.append(move)
-          break
-        
-        # Bump into friend
-        if board.piece_in(t_c).is_friend(self):
-          break
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
 
-    return moves
+    # Move north, east, south, then west
+    yield from self.slider_moves(board, from_c, ORTHOGONAL, captures, quiets)
 
 class Queen(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2655'
     return u'\u265b'
 
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    dummy_bishop = Bishop(self.color)
-    dummy_rook = Rook(self.color)
-
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
     # A Queen's valid_moves is the union of a Bishop and a Rook's valid moves
-    moves = dummy_bishop.valid_moves(board, from_c) \
-      + dummy_rook.valid_moves(board, from_c)
-
-    return moves
+    yield from self.slider_moves(board, from_c, DIAGONAL + ORTHOGONAL, captures, quiets)
 
 class King(Piece):
+  __slots__ = ()
+
   def __str__(self):
     if self.color == 'b': return u'\u2654'
     return u'\u265a'
 
-  def valid_moves(self, board: 'Chessboard', from_c: 'Coord'):
-    moves = []
-
-    # Enumerating possible moves clockwise, starting from north
-    possible_targets = (
-      (from_c.y - 1, from_c.x),
-      (from_c.y - 1, from_c.x + 1),
-      (from_c.y, from_c.x + 1),
-      (from_c.y + 1, from_c.x + 1),
-      (from_c.y + 1, from_c.x),
-      (from_c.y + 1, from_c.x - 1),
-      (from_c.y, from_c.x - 1),
-      (from_c.y + 1, from_c.x - 1)
-    )
-
-    for t_y, t_x in possible_targets:
-      if (Coord.is_in_bounds(t_y, t_x)
-        and (board.empty_in(Coord(t_y, t_x)) or board.piece_in(Coord(t_y, t_x)).is_enemy(self))):
-        moves.append(Move(from_c, Coord(t_y, t_x)))
-
-    return moves
\ No newline at end of file
+  def valid_moves(self, board: 'Chessboard', from_c: 'Coord',
+    captures: bool=True, quiets: bool=True):
+
+    # Possible moves clockwise, starting from north
+    yield from self.leaper_moves(board, from_c,
+      KING_ATTACKS[from_c.y * 8 + from_c.x], captures, quiets)
+
+
+# The board keeps pieces as small ints: the kind of piece, positive for
+# White and negative for Black, with 0 for an empty square.
+EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(7)
+PIECE_TYPES = (Empty, Pawn, Knight, Bishop, Rook, Queen, King)
+
+COLOR_SIGN = {
+  'w': 1,
+  'b': -1,
+}
+
+def piece_code(piece):
+  if type(piece) is Empty:
+    return EMPTY
+
+  return COLOR_SIGN[piece.color] * PIECE_TYPES.index(type(piece))
+
+# Pieces hold nothing but their color, so one instance per code is shared
+# by every board that hands out piece objects.
+PIECE_OF_CODE = {
+  sign * kind: PIECE_TYPES[kind](color)
+  for kind in range(PAWN, KING + 1)
+  for color, sign in COLOR_SIGN.items()
+}
+PIECE_OF_CODE[EMPTY] = Empty()
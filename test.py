@@ -1,7 +1,12 @@
 from chessboard import Chessboard
+from bitboard import BitboardChessboard, BACKENDS
+from perft import PERFT_SUITE
 from pieces import *
 from coord import Coord
 from move import Move
+from cache import BoundedCache
+import queue
+import random
 
 def move_is_valid(board: Chessboard, color: str, from_coord: Coord, to_coord: Coord):
   if from_coord == to_coord:
@@ -171,6 +176,21 @@ def move_is_valid(board: Chessboard, color: str, from_coord: Coord, to_coord: Co
       
   return True, None
 
+"""
+Runs search (an AI, or anything else with its get_best_position_ID) on
+board for the side to move, and returns every SearchResult it handed out.
+"""
+def search_results(search, board: Chessboard, **kwargs):
+  records = queue.SimpleQueue()
+  search.get_best_position_ID(board, board.turn, records, **kwargs)
+
+  results = []
+  while True:
+    result = records.get()
+    if result is None:
+      return results
+    results.append(result)
+
 
 # Test if all moves generated by valid_moves functions are actually valid.
 board = Chessboard()
@@ -187,6 +207,12 @@ tests = (
 )
 
 if __name__ == '__main__':
+  # The searches import this module, so they are only imported here
+  from bench import run_bench, SWITCHES
+  from game import AI, EngineWorker, RootSplitSearch, LazySMPSearch, MATE, LONGFORM_COLOR
+  from transposition import TranspositionTable, SharedTranspositionTable, EXACT, LOWER
+  import time
+
   for piece, color, coord, desc in tests:
     print(f"Testing: {desc}")
     valid_moves = piece.valid_moves(board, coord)
@@ -198,6 +224,434 @@ if __name__ == '__main__':
       except (AssertionError):
         print(f"{move} " + u"\u2717" + f" {reason}")
 
+  # Test that coordinates and moves are shared, and usable in sets
+  print("Testing: shared Coord and Move instances")
+  try:
+    assert Coord(4, 4) is Coord(a_n='e4')
+    assert Move.decode(Move(Coord(6, 4), Coord(4, 4)).encode()) is Move.decode(52 << 6 | 36)
+    assert len({Coord(y, x) for y in range(8) for x in range(8)} | {Coord(0, 0)}) == 64
+    assert Move(Coord(6, 4), Coord(4, 4)) in set(board.legal_moves('w'))
+    try:
+      Move.decode(52 << 6 | 36).to_coord = Coord(5, 4)
+      assert False
+    except (AttributeError):
+      pass
+    assert Move.decode(52 << 6 | 36).to_coord is Coord(4, 4)
+    print("Coord(4, 4), e2e4 " + u"\u2713")
+  except (AssertionError):
+    print("Coord(4, 4), e2e4 " + u"\u2717")
+
+  # Test that passing the turn can be taken back
+  print("Testing: null move")
+  before = board.hash, board.turn, board.last_move
+  last_move = board.make_null_move()
+  try:
+    assert board.hash == board.compute_hash() and board.turn != before[1]
+    board.unmake_null_move(last_move)
+    assert (board.hash, board.turn, board.last_move) == before
+    print("make_null_move / unmake_null_move " + u"\u2713")
+  except (AssertionError):
+    print("make_null_move / unmake_null_move " + u"\u2717")
+
+  # Test that the position caches stay in their budgets, least recently
+  # used entries going first, and count what happens to them
+  print("Testing: bounded caches")
+  cache = BoundedCache(3, 10**6)
+  for key in range(5):
+    cache.add(key)
+  try:
+    assert list(cache.entries) == [2, 3, 4] and cache.evictions == 2
+    print("Entry budget " + u"\u2713")
+  except (AssertionError):
+    print("Entry budget " + u"\u2717" + f" {list(cache.entries)}")
+
+  cache = BoundedCache(3, 10**6)
+  for key in range(3):
+    cache.add(key)
+  try:
+    assert 0 in cache and 5 not in cache
+    cache.add(3)
+    assert list(cache.entries) == [2, 0, 3]
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+    print("Least recently used evicted " + u"\u2713")
+  except (AssertionError):
+    print("Least recently used evicted " + u"\u2717" + f" {cache.stats()}")
+
+  cache = BoundedCache(1000, 2000)
+  for key in range(100):
+    cache.put(key, 'x' * 50)
+  try:
+    assert cache.bytes <= cache.max_bytes
+    assert 0 < len(cache) < 100 and cache.evictions == 100 - len(cache)
+    print(f"Byte budget, {len(cache)} entries " + u"\u2713")
+  except (AssertionError):
+    print("Byte budget " + u"\u2717" + f" {cache.stats()}")
+
+  mated = Chessboard.from_fen('R5k1/5ppp/8/8/8/8/5PPP/6K1 b - - 0 1')
+  checkmates = Chessboard.checkmate_positions
+  try:
+    assert mated.is_checkmate('b')
+    hits = checkmates['b'].hits, checkmates['w'].hits
+    assert mated.is_checkmate('b')
+    assert (checkmates['b'].hits, checkmates['w'].hits) == (hits[0] + 1, hits[1])
+    print("is_checkmate served from checkmate_positions['b'] " + u"\u2713")
+  except (AssertionError):
+    print("is_checkmate served from checkmate_positions['b'] " + u"\u2717")
+
+  # Test that a King attacks the squares next to it, and no others
+  print("Testing: is_attacked by a King")
+  for backend in BACKENDS:
+    for fen, attacked in (('8/8/8/4k3/8/8/8/K7 w - - 0 1', True),
+      ('8/8/4k3/8/8/8/8/K7 w - - 0 1', False)):
+      position = BACKENDS[backend].from_fen(fen)
+      try:
+        # d4, next to the King on e5 and a knight's jump from the one on e6
+        assert position.is_attacked(4 * 8 + 3, 'b') == attacked
+        print(f"{backend} {fen.split()[0]} " + u"\u2713")
+      except (AssertionError):
+        print(f"{backend} {fen.split()[0]} " + u"\u2717" + f" expected {attacked}")
+
+  # Test that unmake_move puts back exactly what make_move took away.
+  print("Testing: make_move / unmake_move round trip")
+  before = list(board.squares)
+  for color in ('w', 'b'):
+    for move in board.legal_moves(color):
+      undo = board.make_move(move)
+      board.unmake_move(undo)
+      try:
+        assert list(board.squares) == before
+        assert board.hash == board.compute_hash()
+        assert board.eval == board.compute_eval()
+        print(f"{move} " + u"\u2713")
+      except (AssertionError):
+        print(f"{move} " + u"\u2717" + " Board differs after unmake_move")
+
+  # Test that legal_moves, which never plays a move to find out whether it
+  # is legal, agrees with playing every pseudolegal move and looking.
+  print("Testing: legal_moves against make_move / is_check")
+  rng = random.Random(0)
+  for game in range(10):
+    position, color = Chessboard(), 'w'
+    try:
+      for ply in range(100):
+        fast = sorted(move.encode() for move in position.legal_moves(color))
+        slow = sorted(move.encode() for move in position.pseudo_legal_moves(color)
+          if position.is_legal(color, move))
+        assert fast == slow
+        if not fast:
+          break
+        position.make_move(Move.decode(rng.choice(fast)))
+        color = 'b' if color == 'w' else 'w'
+      print(f"Game {game} " + u"\u2713")
+    except (AssertionError):
+      print(f"Game {game}, ply {ply} " + u"\u2717" + " legal_moves disagrees")
+
+  # Test that the bitboard backend generates exactly the moves that the
+  # valid_moves implementations in pieces.py do.
+  print("Testing: bitboard backend against valid_moves")
+  for game in range(10):
+    position, color = BitboardChessboard(), 'w'
+    try:
+      for ply in range(100):
+        for sq in position.piece_lists['w'] + position.piece_lists['b']:
+          from_coord = Coord(sq >> 3, sq & 7)
+          bitboard_moves = sorted(move.encode() for move in position.moves_from(sq))
+          piece_moves = sorted(move.encode() for move in
+            position.piece_in(from_coord).valid_moves(position, from_coord))
+          assert bitboard_moves == piece_moves
+
+        moves = list(position.legal_moves(color))
+        if not moves:
+          break
+        position.make_move(rng.choice(moves))
+        color = 'b' if color == 'w' else 'w'
+      print(f"Game {game} " + u"\u2713")
+    except (AssertionError):
+      print(f"Game {game}, ply {ply} " + u"\u2717" + " bitboard moves disagree")
+
+
+  # Test move generation on the perft suite, at the shallow depths
+  print("Testing: perft suite")
+  for backend in BACKENDS:
+    for position in PERFT_SUITE:
+      for depth, expected in position['nodes'].items():
+        if depth > 2: continue
+        nodes = BACKENDS[backend].from_fen(position['fen']).perft(depth)
+        try:
+          assert nodes == expected
+          print(f"{backend} {position['name']} perft({depth}) = {nodes} " + u"\u2713")
+        except (AssertionError):
+          print(f"{backend} {position['name']} perft({depth}) = {nodes} " + u"\u2717" + f" expected {expected}")
+
+
+  # Test the transposition table's buckets: slot 0 keeps the deepest entry
+  # of the current search, slot 1 takes whatever does not fit there
+  print("Testing: transposition table")
+  tt = TranspositionTable(0.001)
+  key = 12345
+  e2e4 = Move.decode(52 << 6 | 36)
+  tt.store(key, 3, -120, EXACT, e2e4)
+  try:
+    assert tt.probe(key) == (3, -120, EXACT, e2e4)
+    print("store, probe " + u"\u2713")
+  except (AssertionError):
+    print("store, probe " + u"\u2717" + f" {tt.probe(key)}")
+
+  shallower = key + tt.bucket_count
+  tt.store(shallower, 1, 50, LOWER)
+  try:
+    assert tt.probe(key) == (3, -120, EXACT, e2e4)
+    assert tt.probe(shallower) == (1, 50, LOWER, None)
+    assert tt.keys[2 * (key % tt.bucket_count) + 1] == shallower
+    print("shallower entry in slot 1 " + u"\u2713")
+  except (AssertionError):
+    print("shallower entry in slot 1 " + u"\u2717")
+
+  try:
+    assert tt.probe(key + 2 * tt.bucket_count) is None
+    print("other key in the bucket misses " + u"\u2713")
+  except (AssertionError):
+    print("other key in the bucket misses " + u"\u2717")
+
+  tt.new_search()
+  newer = key + 2 * tt.bucket_count
+  tt.store(newer, 1, 10, EXACT)
+  try:
+    assert tt.probe(newer) == (1, 10, EXACT, None)
+    assert tt.probe(key) is None
+    assert tt.keys[2 * (key % tt.bucket_count)] == newer
+    print("new_search frees slot 0 " + u"\u2713")
+  except (AssertionError):
+    print("new_search frees slot 0 " + u"\u2717")
+
+
+  # Test that searching the same positions twice searches the same tree
+  print("Testing: search is reproducible")
+  for backend in BACKENDS:
+    first, second = run_bench(backend, 3), run_bench(backend, 3)
+    try:
+      assert first['signature'] == second['signature']
+      assert first['nodes'] == second['nodes']
+      print(f"{backend} signature {first['signature']} " + u"\u2713")
+    except (AssertionError):
+      print(f"{backend} signature {first['signature']} != {second['signature']} " + u"\u2717")
+
+  # Test that the bench switches reach the search it measures
+  print("Testing: bench switches")
+  default = run_bench('array', 4)
+  for switch in ('aspiration', 'null_move'):
+    disabled = run_bench('array', 4, disable=(switch,))
+    try:
+      assert disabled['signature'] != default['signature']
+      print(f"--disable {switch}: {disabled['nodes']} nodes " + u"\u2713")
+    except (AssertionError):
+      print(f"--disable {switch}: signature unchanged " + u"\u2717")
+
+  # Test that quiescence search sees the recapture past the depth limit: at
+  # depth 1, Qxd5 wins a pawn and loses the queen to exd5
+  print("Testing: quiescence search")
+  fen = '4k3/8/4p3/3p4/8/8/8/3QK3 w - - 0 1'
+  for max_qdepth, grabs in ((0, True), (6, False)):
+    board = Chessboard.from_fen(fen)
+    results = search_results(AI('w', max_qdepth=max_qdepth), board, max_depth=1)
+    move = Move.decode(results[-1].move).notation()
+    try:
+      assert (move == 'd1d5') == grabs
+      print(f"max_qdepth {max_qdepth}: {move} " + u"\u2713")
+    except (AssertionError):
+      print(f"max_qdepth {max_qdepth}: {move} " + u"\u2717")
+
+  # A pawn capture that cannot bring the score up to alpha is never played
+  stand_pat = board.evaluate()
+  searched = []
+  for alpha in (stand_pat + 1000, stand_pat - 1):
+    ai = AI('w')
+    ai.quiescence(board, 'w', alpha, float('+inf'), 0)
+    searched.append(ai.qnodes)
+  try:
+    assert searched[0] == 1 and searched[1] > 1
+    print(f"Delta pruning: {searched[0]} against {searched[1]} nodes " + u"\u2713")
+  except (AssertionError):
+    print(f"Delta pruning: {searched} " + u"\u2717")
+
+
+  # Test that the search stops by its deadline and still hands out a move
+  print("Testing: search deadline")
+  board = Chessboard.from_fen(PERFT_SUITE[1]['fen'])
+  before = bytes(board.squares), board.hash
+  start = time.monotonic()
+  results = search_results(AI(board.turn), board, deadline=start + 0.3)
+  seconds = time.monotonic() - start
+  try:
+    assert seconds < 1.0
+    assert results and results[-1].move is not None
+    assert (bytes(board.squares), board.hash) == before
+    print(f"Stopped after {seconds:.2f}s at depth {results[-1].depth} " + u"\u2713")
+  except (AssertionError):
+    print(f"Stopped after {seconds:.2f}s with {len(results)} results " + u"\u2717")
+
+
+  # Test that the engine worker follows the game across several searches
+  print("Testing: engine worker")
+  board = Chessboard.from_fen(PERFT_SUITE[1]['fen'])
+  engine = EngineWorker(board.turn)
+  engine.position(board)
+  try:
+    for turn in range(3):
+      result = engine.go(0.2)
+      move = Move.decode(result.move)
+      assert board.is_legal(board.turn, move)
+      assert result.pv[0] == result.move
+      board.make_move(move)
+      engine.move(move)
+      print(f"Turn {turn}: {move.notation()} at depth {result.depth}, line {len(result.pv)} moves " + u"\u2713")
+  except (AssertionError):
+    print(f"Turn {turn}: {move} " + u"\u2717")
+  engine.close()
+
+  # Test that PVS, aspiration windows, selective search and pruning change
+  # the effort, not the result
+  print("Testing: principal variation and selective search")
+  for position in PERFT_SUITE[:4]:
+    found = []
+    for selective in (False, True):
+      ai = AI('w')
+      for switch in SWITCHES:
+        setattr(ai, f"use_{switch}", selective)
+      results = search_results(ai, Chessboard.from_fen(position['fen']), max_depth=4)
+      found.append((results[-1].score, results[-1].move, len(results[-1].pv)))
+    try:
+      assert found[0] == found[1]
+      assert found[1][2] == 4
+      print(f"{position['name']} score {found[1][0]}, line of {found[1][2]} " + u"\u2713")
+    except (AssertionError):
+      print(f"{position['name']} {found[1]} " + u"\u2717" + f" expected {found[0]}")
+
+  # Test that a move that failed high is kept when the search is stopped in
+  # the middle of searching it again with a wider window
+  print("Testing: stop during an aspiration re-search")
+  for fen, first in (('4k3/8/8/Q2q4/8/8/8/4K3 b - - 0 1', 'd5a5'),
+    ('4k3/8/8/q2Q4/8/8/8/4K3 w - - 0 1', 'd5a5')):
+    board = Chessboard.from_fen(fen)
+    ai = AI(board.turn)
+    search = ai.get_best_position
+    root_searches = []
+    def stop_on_research(board, color, depth, *args):
+      if depth == 0:
+        root_searches.append(args)
+        # The search notices stop before its first node
+        ai.stopped = len(root_searches) > 1
+      return search(board, color, depth, *args)
+    ai.get_best_position = stop_on_research
+    score, best_move = ai.search_root(board, board.turn, 3, 0)
+    try:
+      assert len(root_searches) == 2
+      assert best_move is not None and best_move.notation() == first
+      print(f"{LONGFORM_COLOR[board.turn]} keeps {first} " + u"\u2713")
+    except (AssertionError):
+      print(f"{LONGFORM_COLOR[board.turn]} {best_move} " + u"\u2717" + f" expected {first}")
+
+  # The same, for a root move that failed high on principal variation
+  # search's null window. Between two searches of the root's replies, only
+  # the root itself can have counted a re-search.
+  print("Testing: stop during a PVS re-search")
+  for fen, first in ((PERFT_SUITE[0]['fen'], 'd2d4'),
+    ('k7/8/8/3q4/4P3/5P2/8/K7 b - - 0 1', 'd5e6')):
+    board = Chessboard.from_fen(fen)
+    ai = AI(board.turn)
+    search = ai.get_best_position
+    researched = []
+    researches = [None]
+    def stop_on_research(board, color, depth, *args):
+      if depth == 1 and researches[0] is not None and ai.pvs_researches > researches[0]:
+        researched.append(board.last_move)
+        ai.stopped = True
+      score, move = search(board, color, depth, *args)
+      if depth == 1:
+        researches[0] = ai.pvs_researches
+      return score, move
+    ai.get_best_position = stop_on_research
+    score, best_move = ai.search_root(board, board.turn, 3)
+    try:
+      assert [move.notation() for move in researched] == [first]
+      assert best_move is not None and best_move.notation() == first
+      print(f"{LONGFORM_COLOR[board.turn]} keeps {first} " + u"\u2713")
+    except (AssertionError):
+      print(f"{LONGFORM_COLOR[board.turn]} {best_move} " + u"\u2717" + f" expected {first}")
+
+  # Test that the shortest mate is found, and scored by its distance
+  print("Testing: mate scores")
+  for fen, plies, first in (('6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1', 1, 'a1a8'),
+    ('7k/8/8/8/8/8/R7/1R4K1 w - - 0 1', 3, 'b1b7'),
+    ('1r4k1/8/8/8/8/8/r7/7K b - - 0 1', 1, 'b8b1')):
+    board = Chessboard.from_fen(fen)
+    results = search_results(AI(board.turn), board, max_depth=6)
+    try:
+      assert abs(results[-1].score) == MATE - plies
+      assert Move.decode(results[-1].move).notation() == first
+      assert len(results[-1].pv) == plies
+      print(f"Mate in {plies} plies, {first} " + u"\u2713")
+    except (AssertionError):
+      print(f"Mate in {plies} plies " + u"\u2717" + f" {results[-1]}")
+
+  # Test that stalemate is a draw, not a mate: Qf7 would stalemate, Qf8 mates
+  for fen, score, first in (('7k/8/6K1/8/8/8/8/5Q2 w - - 0 1', MATE - 1, 'f1f8'),
+    ('7k/5Q2/6K1/8/8/8/8/8 b - - 0 1', 0, None),
+    ('8/8/8/8/8/6k1/5q2/7K w - - 0 1', 0, None)):
+    board = Chessboard.from_fen(fen)
+    results = search_results(AI(board.turn), board, max_depth=4)
+    move = Move.decode(results[-1].move).notation() if results[-1].move is not None else None
+    try:
+      assert (results[-1].score, move) == (score, first)
+      print(f"{fen.split()[0]}: score {score}, {first} " + u"\u2713")
+    except (AssertionError):
+      print(f"{fen.split()[0]} " + u"\u2717" + f" {results[-1]}")
+
+  # Test that splitting the root across processes finds the same scores
+  print("Testing: root-split search")
+  root_split = RootSplitSearch(2)
+  for position in PERFT_SUITE[:4]:
+    scores = []
+    for search in (AI('w'), root_split):
+      results = search_results(search, Chessboard.from_fen(position['fen']), max_depth=3)
+      scores.append(results[-1].score)
+    try:
+      assert scores[0] == scores[1]
+      print(f"{position['name']} score {scores[1]} " + u"\u2713")
+    except (AssertionError):
+      print(f"{position['name']} score {scores[1]} " + u"\u2717" + f" expected {scores[0]}")
+  root_split.close()
+
+  # Test that the shared transposition table turns half written entries away
+  print("Testing: shared transposition table")
+  shared = SharedTranspositionTable(1)
+  key = board.hash
+  shared.store(key, 3, -120, EXACT, Move.decode(52 << 6 | 36))
+  try:
+    depth, score, bound, move = shared.probe(key)
+    assert (depth, score, bound, move.encode()) == (3, -120, EXACT, 52 << 6 | 36)
+    slot = 1 + 4 * (key % shared.bucket_count)
+    shared.words[slot + 1] ^= 1 << 40
+    assert shared.probe(key) is None
+    print("Stored, probed, torn " + u"\u2713")
+  except (AssertionError, TypeError):
+    print("Stored, probed, torn " + u"\u2717")
+  shared.close()
+
+  # Test that Lazy SMP helpers and the main search share the table
+  print("Testing: Lazy SMP")
+  lazy_smp = LazySMPSearch(2)
+  for position in PERFT_SUITE[:4]:
+    board = Chessboard.from_fen(position['fen'])
+    results = search_results(lazy_smp, board, max_depth=3)
+    try:
+      assert board.is_legal(board.turn, Move.decode(results[-1].move))
+      assert lazy_smp.helper_nodes > 0
+      print(f"{position['name']} {Move.decode(results[-1].move).notation()} " + u"\u2713")
+    except (AssertionError):
+      print(f"{position['name']} {results[-1]} " + u"\u2717")
+  lazy_smp.close()
+
 
 # Test whilst playing the game
 def dynamic_move_test(board: 'Board', piece: 'Piece', color: 'str', coord: 'Coord'):
@@ -0,0 +1,231 @@
+from move import Move
+from array import array
+from multiprocessing import shared_memory
+
+EXACT = 0
+LOWER = 1 # Score is at least this good for White (the search failed high)
+UPPER = 2 # Score is at most this good for White (the search failed low)
+
+NO_MOVE = 0
+
+DEFAULT_SIZE_MB = 16
+
+# keys (8) + scores (8) + depths (1) + bounds (1) + moves (2) + ages (1)
+ENTRY_BYTES = 21
+
+"""
+Fixed-size transposition table.
+
+Every field lives in its own preallocated array, so the table never grows
+past the size it was created with. The table is split into buckets of two
+slots each, and a position can only ever be stored in bucket
+hash % bucket_count:
+- Slot 0 is depth-preferred. It is only overwritten by a search at least as
+  deep, or when its entry is left over from an earlier search.
+- Slot 1 is always-replace. Whatever did not make it into slot 0 lands here.
+
+Scores are White-relative, like everything else in the search.
+"""
+class TranspositionTable:
+  def __init__(self, size_mb: float=DEFAULT_SIZE_MB):
+    self.bucket_count = max(1, int(size_mb * 2**20) // (2 * ENTRY_BYTES))
+    slots = 2 * self.bucket_count
+
+    self.keys = array('Q', bytes(8 * slots))
+    self.scores = array('d', bytes(8 * slots))
+    self.depths = array('b', bytes(slots))
+    self.bounds = array('B', bytes(slots))
+    self.moves = array('H', bytes(2 * slots))
+    self.ages = array('B', bytes(slots))
+
+    # Age 0 marks a slot that has never been written
+    self.age = 1
+
+    self.probes = 0
+    self.hits = 0
+
+  """
+  Called at the start of every new search (not every iteration), so that
+  entries from earlier searches give way to fresh ones.
+  """
+  def new_search(self):
+    self.age = self.age % 255 + 1
+
+  def _slot(self, key: int):
+    slot = 2 * (key % self.bucket_count)
+
+    if self.ages[slot] and self.keys[slot] == key:
+      return slot
+    if self.ages[slot + 1] and self.keys[slot + 1] == key:
+      return slot + 1
+
+    return None
+
+  """
+  Returns (depth, score, bound, best_move) stored for key, or None.
+  best_move is None when the entry did not record one.
+  """
+  def probe(self, key: int):
+    self.probes += 1
+    slot = self._slot(key)
+    if slot is None:
+      return None
+    self.hits += 1
+
+    code = self.moves[slot]
+    best_move = Move.decode(code) if code != NO_MOVE else None
+
+    # Scores are stored as doubles so that +-inf fits, but evaluations are ints
+    score = self.scores[slot]
+    if score.is_integer():
+      score = int(score)
+
+    return self.depths[slot], score, self.bounds[slot], best_move
+
+  def store(self, key: int, depth: int, score: float, bound: int, best_move: Move=None):
+    slot = 2 * (key % self.bucket_count)
+
+    # Keep a deeper result for the same position in the depth-preferred slot
+    # rather than demote it to the always-replace slot.
+    if (self.ages[slot] == self.age
+      and depth < self.depths[slot]):
+      slot += 1
+
+    code = best_move.encode() if best_move is not None else NO_MOVE
+
+    # Do not forget the best move of a position we already knew about
+    if code == NO_MOVE and self.ages[slot] and self.keys[slot] == key:
+      code = self.moves[slot]
+
+    self.keys[slot] = key
+    self.scores[slot] = score
+    self.depths[slot] = depth
+    self.bounds[slot] = bound
+    self.moves[slot] = code
+    self.ages[slot] = self.age
+
+# Packing of a shared table entry's data word, from the low bits up
+MOVE_BITS = 12
+BOUND_SHIFT = 12
+DEPTH_SHIFT = 16
+AGE_SHIFT = 24
+SCORE_SHIFT = 32
+
+# Scores are packed as 32 bit ints, with room at the ends for +-inf
+SCORE_INF = 2**31 - 1
+
+# key ^ data (8) + data (8)
+SHARED_ENTRY_BYTES = 16
+
+"""
+Transposition table in shared memory, for search processes to share.
+
+Works like TranspositionTable, buckets and replacement included, but every
+entry is packed into two 64 bit words of a multiprocessing.shared_memory
+block: the data (score, age, depth, bound and move) and the key XORed with
+the data. Writers take no lock. A reader that catches an entry half
+written finds that the words do not XOR back to its key, and takes it for
+a miss. The search age lives in the block too, in the first word, so that
+new_search in one process counts for all of them.
+
+The process that creates the table owns the block and unlinks it in
+close(). Pickling the table, to hand it to a spawned process, attaches to
+the same block by name.
+"""
+class SharedTranspositionTable:
+  def __init__(self, size_mb: float=DEFAULT_SIZE_MB):
+    self.bucket_count = max(1, int(size_mb * 2**20) // (2 * SHARED_ENTRY_BYTES))
+    self.memory = shared_memory.SharedMemory(create=True,
+      size=8 + 2 * self.bucket_count * SHARED_ENTRY_BYTES)
+    self.owner = True
+    self.attach()
+    self.words[0] = 1
+
+  def attach(self):
+    self.words = self.memory.buf.cast('Q')
+    self.probes = 0
+    self.hits = 0
+
+  def __getstate__(self):
+    return self.memory.name, self.bucket_count
+
+  def __setstate__(self, state):
+    name, self.bucket_count = state
+    self.memory = shared_memory.SharedMemory(name=name)
+    self.owner = False
+    self.attach()
+
+  def close(self):
+    self.words.release()
+    self.memory.close()
+    if self.owner:
+      self.memory.unlink()
+
+  @property
+  def age(self):
+    return self.words[0]
+
+  def new_search(self):
+    self.words[0] = self.words[0] % 255 + 1
+
+  """
+  The data word of the entry in slot (0 or 1) of key's bucket, if the
+  entry is for key and was written whole, else None.
+  """
+  def _data(self, key: int, slot: int):
+    index = 1 + 2 * slot
+    data = self.words[index + 1]
+    if data >> AGE_SHIFT & 0xFF and self.words[index] ^ data == key:
+      return data
+
+    return None
+
+  def probe(self, key: int):
+    self.probes += 1
+    slot = 2 * (key % self.bucket_count)
+
+    data = self._data(key, slot)
+    if data is None:
+      data = self._data(key, slot + 1)
+      if data is None:
+        return None
+    self.hits += 1
+
+    code = data & (1 << MOVE_BITS) - 1
+    best_move = Move.decode(code) if code != NO_MOVE else None
+
+    score = (data >> SCORE_SHIFT) - 2**31
+    if abs(score) == SCORE_INF:
+      score = float('inf') if score > 0 else float('-inf')
+
+    return data >> DEPTH_SHIFT & 0xFF, score, data >> BOUND_SHIFT & 3, best_move
+
+  def store(self, key: int, depth: int, score: float, bound: int, best_move: Move=None):
+    words = self.words
+    age = words[0]
+    slot = 2 * (key % self.bucket_count)
+
+    # Keep a deeper result for the same position in the depth-preferred slot
+    # rather than demote it to the always-replace slot.
+    data = words[2 + 2 * slot]
+    if (data >> AGE_SHIFT & 0xFF == age
+      and depth < (data >> DEPTH_SHIFT & 0xFF)):
+      slot += 1
+
+    code = best_move.encode() if best_move is not None else NO_MOVE
+
+    # Do not forget the best move of a position we already knew about
+    if code == NO_MOVE:
+      data = self._data(key, slot)
+      if data is not None:
+        code = data & (1 << MOVE_BITS) - 1
+
+    if abs(score) == float('inf'):
+      score = SCORE_INF if score > 0 else -SCORE_INF
+
+    data = ((int(score) + 2**31) << SCORE_SHIFT | age << AGE_SHIFT
+      | depth << DEPTH_SHIFT | bound << BOUND_SHIFT | code)
+
+    index = 1 + 2 * slot
+    words[index] = key ^ data
+    words[index + 1] = data
@@ -0,0 +1,19 @@
+from pieces import *
+import random
+
+# A fixed seed keeps the keys identical across runs and across worker
+# processes, so hashes can be shared between them.
+_rng = random.Random(0x5EED)
+
+"""
+One random 64-bit key per piece code per square, indexed by y * 8 + x.
+A position's key is the XOR of the keys of every piece on the board, with
+SIDE_TO_MOVE mixed in when Black is to move.
+"""
+PIECE_KEYS = {
+  sign * kind: [_rng.getrandbits(64) for _ in range(64)]
+  for kind in range(PAWN, KING + 1)
+  for sign in (1, -1)
+}
+
+SIDE_TO_MOVE = _rng.getrandbits(64)